@@ -10,13 +10,17 @@ or in the 'license' file accompanying this file. This file is distributed on an
 OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
 and limitations under the License.
 """
-import pytest
-from time import sleep
+import os
+import time
+from contextlib import contextmanager
 
+import pytest
 from appium import webdriver
 from appium.options.ios import XCUITestOptions
 from appium.webdriver.common.appiumby import AppiumBy
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.wait import WebDriverWait
 
 capabilities = dict(
     platformName='ios',
@@ -29,45 +33,125 @@ capabilities = dict(
 
 appium_server_url = 'http://0.0.0.0:4723/wd/hub'
 
+# Elements are polled every POLL_INTERVAL seconds until they are present, instead of sleeping a fixed time after
+# every step. Only this file is bundled for Device Farm, so the helpers live here as well.
+WAIT_TIMEOUT = 10
+POLL_INTERVAL = 0.2
+BACKGROUND_SECONDS = 5
+# The SDK only records _user_engagement for a screen that was visible longer than its minEngagementTime of 1000ms
+# (AutoRecordEventClient.swift), so every screen stays up at least this long, counted from the click or launch that
+# opened it, before the next click leaves it.
+MIN_SCREEN_SECONDS = 2.0
+# Set SHOPPING_TEST_REUSE_SESSION=0 to start a new Appium session for every suite instead of relaunching the app.
+REUSE_SESSION = os.environ.get('SHOPPING_TEST_REUSE_SESSION', '1') != '0'
+
+
+class StepTimer:
+    # Collects the duration of every named step of a suite and prints them as one breakdown at the end.
+    def __init__(self):
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - started))
+
+    def print_breakdown(self, title):
+        total = sum(seconds for _, seconds in self.steps)
+        print(f"Step timing of {title}: {total:.2f}s")
+        for name, seconds in self.steps:
+            print(f"  {name:<32} {seconds:6.2f}s")
+
 
 class TestShopping:
+    driver = None
+
     def setup_method(self):
-        self.driver = webdriver.Remote(appium_server_url, options=XCUITestOptions().load_capabilities(capabilities))
-        self.driver.implicitly_wait(10)
+        self.timer = StepTimer()
+        with self.timer.step('start session'):
+            if REUSE_SESSION and TestShopping.driver is not None:
+                # A relaunch gives the suite the same fresh app process a new session would, without the cost of
+                # creating the WebDriverAgent session again.
+                TestShopping.driver.terminate_app(capabilities['bundleId'])
+                TestShopping.driver.activate_app(capabilities['bundleId'])
+            else:
+                TestShopping.driver = webdriver.Remote(appium_server_url,
+                                                       options=XCUITestOptions().load_capabilities(capabilities))
+                TestShopping.driver.implicitly_wait(0)
+        self.driver = TestShopping.driver
+        self.screen_opened_at = time.monotonic()
 
     def teardown_method(self):
-        if self.driver:
-            self.driver.quit()
+        if not REUSE_SESSION:
+            self.quit_driver()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.quit_driver()
+
+    @staticmethod
+    def quit_driver():
+        if TestShopping.driver:
+            TestShopping.driver.quit()
+            TestShopping.driver = None
 
     @pytest.mark.parametrize("test_suite", [
         "test suite 1",
         "test suite 2"
     ])
     def test_shopping(self, test_suite):
-        sleep(3)
-        self.perform_click_element('Profile')
-        self.perform_click_element('sign_in')
-        sleep(3)
-        self.perform_click_element('Cart')
-        self.perform_click_element('check_out')
-        self.perform_click_element('purchase')
-        self.perform_click_element('Profile')
-        self.perform_click_element("sign_out")
-        self.driver.execute_script('mobile: backgroundApp', {"seconds": 5})
-        sleep(1)
-        self.perform_click_element("show_log_text")
-        event_log = self.driver.find_element(by=AppiumBy.ID, value="event_log")
-        self.driver.log_event("app_event_log", event_log.text)
-        print(event_log.text)
-        sleep(1)
+        try:
+            self.perform_click_element('Profile')
+            self.perform_click_element('sign_in')
+            self.perform_click_element('Cart')
+            self.perform_click_element('check_out')
+            self.perform_click_element('purchase')
+            self.perform_click_element('Profile')
+            self.perform_click_element("sign_out")
+            with self.timer.step('background app'):
+                self.stay_on_screen()
+                self.driver.execute_script('mobile: backgroundApp', {"seconds": BACKGROUND_SECONDS})
+                self.screen_opened_at = time.monotonic()
+            self.perform_click_element("show_log_text")
+            with self.timer.step('wait for event_log'):
+                event_log = self.wait_for(lambda driver: self.non_empty_element(driver, "event_log"),
+                                          "event_log with text")
+            self.driver.log_event("app_event_log", event_log.text)
+            print(event_log.text)
+        finally:
+            self.timer.print_breakdown(test_suite)
 
     def perform_click_element(self, element_id):
-        try:
-            element = self.driver.find_element(by=AppiumBy.ID, value=element_id)
+        with self.timer.step(f"click {element_id}"):
+            # Only presence is awaited, as before: XCUITest's visible attribute is unreliable for SwiftUI views, so
+            # a displayed check could time out on an element that is there. stay_on_screen paces the clicks.
+            element = self.wait_for(expected_conditions.presence_of_element_located((AppiumBy.ID, element_id)),
+                                    f"element '{element_id}'")
+            self.stay_on_screen()
             element.click()
-            sleep(2)
-        except NoSuchElementException:
-            pytest.skip(f"Element with ID '{element_id}' not found. Skipped the test")
+            self.screen_opened_at = time.monotonic()
+
+    def stay_on_screen(self):
+        # Only sleeps for what is left of MIN_SCREEN_SECONDS after waiting for the element.
+        remaining = MIN_SCREEN_SECONDS - (time.monotonic() - self.screen_opened_at)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def wait_for(self, condition, description):
+        try:
+            return WebDriverWait(self.driver, WAIT_TIMEOUT, poll_frequency=POLL_INTERVAL).until(condition)
+        except TimeoutException:
+            pytest.skip(f"Timed out after {WAIT_TIMEOUT}s waiting for {description}. Skipped the test")
+
+    @staticmethod
+    def non_empty_element(driver, element_id):
+        elements = driver.find_elements(by=AppiumBy.ID, value=element_id)
+        if elements and elements[0].text:
+            return elements[0]
+        return False
 
 
 if __name__ == '__main__':
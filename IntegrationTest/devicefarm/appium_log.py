@@ -0,0 +1,541 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+from collections import namedtuple
+
+from instrumentation import instrumentation
+
+SAVED_EVENT_MARKER = b'Saved event'
+FIRST_EVENT_MARKER = b'app_event_log:Saved event'
+BATCH_MARKER = b'Send '
+EVENT_PATTERN = re.compile(rb'Saved event (\w+):([^\r\n]*)')
+BATCH_PATTERN = re.compile(rb'Send (\d+) events(?: at (\d+))?')
+TIMESTAMP_PATTERN = re.compile(rb'"timestamp":(\d+)')
+EVENT_ID_PATTERN = re.compile(rb'"event_id":"([^"]*)"')
+EVENT_ENTRY = 'event'
+RESTART_ENTRY = 'restart'
+BATCH_ENTRY = 'batch'
+FOLLOW_CHUNK_SIZE = 1024 * 1024
+# Parsed logs are cached in a sidecar file next to each log, set APPIUM_LOG_SIDECAR=0 to always parse the log.
+LOG_SIDECAR_ENABLED = os.environ.get('APPIUM_LOG_SIDECAR', '1') != '0'
+SIDECAR_SUFFIX = '.scan'
+SIDECAR_MAGIC = b'APPIUMLOGSCAN\n'
+SIDECAR_VERSION = 3
+SIDECAR_LENGTH = struct.Struct('<Q')
+SIGNATURE_SAMPLES = 16
+SIGNATURE_SAMPLE_SIZE = 64 * 1024
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'size'])
+# restart_events are the _app_start events of an app coming back from background, which recorded_events leaves out;
+# batch_send_times holds the send time of every batch in milliseconds, or -1 for logs without send times.
+LogScan = namedtuple('LogScan', ['recorded_events', 'submitted_events', 'event_offsets', 'batch_offsets',
+                                 'payload_offsets', 'batch_send_times', 'restart_events', 'restart_offsets',
+                                 'restart_payload_offsets'])
+
+
+class ParsedLogCache:
+    # Keeps one parsed result per appium.log and parser for the whole pytest session. An entry is
+    # parsed again only when the size or modification time of the log on disk changes.
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, parser):
+        abs_path = os.path.abspath(path)
+        stat = os.stat(abs_path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        key = (abs_path, parser.__name__)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        result = parser(abs_path)
+        self._entries[key] = (signature, result)
+        return result
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class RecordedEvent:
+    # One saved event of the log. The JSON payload stays undecoded until event_json is read for the first time,
+    # since most checks only look at the event name. source holds the payload between start and end: the bytes of
+    # the log line after a scan, or the memory mapped log itself after a reload from the sidecar cache.
+    __slots__ = ('event_name', 'timestamp', '_source', '_start', '_end', '_event_json')
+
+    def __init__(self, event_name, source, start=0, end=None, timestamp=None):
+        self.event_name = event_name
+        self.timestamp = timestamp
+        self._source = source
+        self._start = start
+        self._end = len(source) if end is None else end
+        self._event_json = None
+
+    @property
+    def payload_length(self):
+        return self._end - self._start
+
+    @property
+    def event_json(self):
+        if self._event_json is None:
+            self._event_json = json.loads(self._source[self._start:self._end])
+            self._source = None
+        return self._event_json
+
+    def payload_timestamp(self):
+        # The event timestamp, -1 when it is missing.
+        if self.timestamp is not None:
+            return self.timestamp
+        value = self._top_level_value(TIMESTAMP_PATTERN, 'timestamp')
+        return -1 if value is None else int(value)
+
+    def payload_event_id(self):
+        # The event_id, None when it is missing.
+        value = self._top_level_value(EVENT_ID_PATTERN, 'event_id')
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def _top_level_value(self, pattern, key):
+        # Reads a top-level key without decoding the payload when the key occurs only once. The SDK writes the
+        # keys sorted, so an attribute or item with the same name comes before the top-level key; when the key
+        # occurs more than once the payload is decoded instead.
+        if self._source is None:
+            return self._event_json.get(key)
+        first_match = pattern.search(self._source, self._start, self._end)
+        if first_match is None:
+            return None
+        if pattern.search(self._source, first_match.end(), self._end) is None:
+            return first_match.group(1)
+        return self.event_json.get(key)
+
+    def __repr__(self):
+        return f"RecordedEvent({self.event_name!r})"
+
+
+class EventStore:
+    # Recorded events in log order plus an index from event name to positions, so a lookup by name only
+    # touches the events with that name instead of scanning the whole session.
+    def __init__(self, events=()):
+        self._events = []
+        self._positions = {}
+        self._timestamp_views = {}
+        for event in events:
+            self.append(event)
+
+    def append(self, event):
+        event_name = event.event_name
+        positions = self._positions.get(event_name)
+        if positions is None:
+            positions = self._positions[event_name] = []
+        positions.append(len(self._events))
+        self._events.append(event)
+        self._timestamp_views.pop(event_name, None)
+
+    def __len__(self):
+        return len(self._events)
+
+    def __iter__(self):
+        return iter(self._events)
+
+    def __getitem__(self, index):
+        return self._events[index]
+
+    def names(self):
+        return sorted(self._positions)
+
+    def named(self, event_name):
+        return [self._events[position] for position in self._positions.get(event_name, ())]
+
+    def count(self, event_name):
+        return len(self._positions.get(event_name, ()))
+
+    def sorted_by_timestamp(self, event_name):
+        # The sorted view is built on first use and kept until another event with this name is appended.
+        view = self._timestamp_views.get(event_name)
+        if view is None:
+            view = sorted(self.named(event_name),
+                          key=event_timestamp)
+            self._timestamp_views[event_name] = view
+        return view
+
+
+def event_timestamp(event):
+    if event.timestamp is not None:
+        return event.timestamp
+    return event.event_json.get('timestamp', float('inf'))
+
+
+parsed_log_cache = ParsedLogCache()
+
+
+def get_cached_log_scan(path):
+    return parsed_log_cache.get(path, load_or_scan_log)
+
+
+def get_cached_recorded_events(path):
+    return get_cached_log_scan(path).recorded_events
+
+
+def get_cached_submitted_events(path):
+    return get_cached_log_scan(path).submitted_events
+
+
+def get_submitted_events(path):
+    return scan_log(path).submitted_events
+
+
+def get_recorded_events(path):
+    return scan_log(path).recorded_events
+
+
+def scan_log(path):
+    # Reads the log once and collects the recorded events, the size and send time of every uploaded batch and the
+    # byte offset of the line each of them was found on.
+    builder = LogScanBuilder()
+    with instrumentation.span('log_parsing', log=path):
+        for entry in iter_log_entries(path, include_restarts=True):
+            builder.add(*entry)
+    instrumentation.count('log_bytes_parsed', os.path.getsize(path))
+    return builder.log_scan()
+
+
+class LogScanBuilder:
+    # Collects log entries into the columns of a LogScan, whether the log is read at once or in pieces.
+    def __init__(self):
+        self.recorded_events = EventStore()
+        self.submitted_events = []
+        self.event_offsets = array('Q')
+        self.batch_offsets = array('Q')
+        self.payload_offsets = array('Q')
+        self.batch_send_times = array('q')
+        self.restart_events = []
+        self.restart_offsets = array('Q')
+        self.restart_payload_offsets = array('Q')
+
+    def add(self, kind, offset, value, payload, payload_offset):
+        # Returns the RecordedEvent of an event entry, None for the other entries.
+        if kind == BATCH_ENTRY:
+            self.submitted_events.append(value)
+            self.batch_offsets.append(offset)
+            self.batch_send_times.append(-1 if payload is None else payload)
+            return None
+        event = RecordedEvent(value, payload)
+        if kind == RESTART_ENTRY:
+            self.restart_events.append(event)
+            self.restart_offsets.append(offset)
+            self.restart_payload_offsets.append(payload_offset)
+            return None
+        self.recorded_events.append(event)
+        self.event_offsets.append(offset)
+        self.payload_offsets.append(payload_offset)
+        return event
+
+    def log_scan(self):
+        return LogScan(self.recorded_events, self.submitted_events, self.event_offsets, self.batch_offsets,
+                       self.payload_offsets, self.batch_send_times, self.restart_events, self.restart_offsets,
+                       self.restart_payload_offsets)
+
+
+def load_or_scan_log(path):
+    # Reloads the scan from the sidecar cache next to the log when it still matches the log, otherwise scans the
+    # log and writes the sidecar for the next run.
+    if not LOG_SIDECAR_ENABLED:
+        return scan_log(path)
+    log_scan = load_log_sidecar(path)
+    if log_scan is not None:
+        instrumentation.count('log_sidecar_hits')
+        return log_scan
+    log_scan = scan_log(path)
+    try:
+        write_log_sidecar(path, log_scan)
+    except OSError as e:
+        print(f"Couldn't write the parsed log cache of {path}: {e}")
+    return log_scan
+
+
+def write_log_sidecar(path, log_scan):
+    # The sidecar holds a JSON header with the log signature and the interned event names, followed by one
+    # 8-byte aligned column per field, so a reload only maps the file and casts memoryviews over the columns.
+    events = log_scan.recorded_events
+    names = events.names()
+    name_ids = {name: index for index, name in enumerate(names)}
+    columns = [
+        ('event_name_ids', array('I', (name_ids[event.event_name] for event in events))),
+        ('event_timestamps', array('q', (event.payload_timestamp() for event in events))),
+        ('payload_lengths', array('I', (event.payload_length for event in events))),
+        ('payload_offsets', array('Q', log_scan.payload_offsets)),
+        ('event_offsets', array('Q', log_scan.event_offsets)),
+        ('submitted_events', array('I', log_scan.submitted_events)),
+        ('batch_offsets', array('Q', log_scan.batch_offsets)),
+        ('batch_send_times', array('q', log_scan.batch_send_times)),
+        ('restart_timestamps', array('q', (event.payload_timestamp() for event in log_scan.restart_events))),
+        ('restart_payload_lengths', array('I', (event.payload_length for event in log_scan.restart_events))),
+        ('restart_payload_offsets', array('Q', log_scan.restart_payload_offsets)),
+        ('restart_offsets', array('Q', log_scan.restart_offsets)),
+    ]
+    column_layout = {}
+    position = 0
+    for name, column in columns:
+        column_layout[name] = [position, column.typecode, len(column)]
+        position = align(position + len(column) * column.itemsize)
+    header = json.dumps({'version': SIDECAR_VERSION, 'signature': log_signature(path), 'names': names,
+                         'columns': column_layout}).encode('utf-8')
+    data_start = align(len(SIDECAR_MAGIC) + SIDECAR_LENGTH.size + len(header))
+    sidecar_path = path + SIDECAR_SUFFIX
+    # Every writer gets its own temporary file, so processes scanning the same log never write into one file and
+    # the sidecar is only ever replaced by a complete one.
+    fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(sidecar_path) or '.',
+                                        prefix=os.path.basename(sidecar_path) + '.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(SIDECAR_MAGIC)
+            file.write(SIDECAR_LENGTH.pack(len(header)))
+            file.write(header)
+            for name, column in columns:
+                file.seek(data_start + column_layout[name][0])
+                column.tofile(file)
+            file.truncate(data_start + position)
+        os.replace(partial_path, sidecar_path)
+    except BaseException:
+        os.unlink(partial_path)
+        raise
+
+
+def load_log_sidecar(path):
+    # Returns the LogScan stored next to the log, or None when there is none or it belongs to another version
+    # of the log. A damaged or unreadable sidecar counts as missing, so the log is parsed again and the sidecar
+    # rewritten.
+    try:
+        return read_log_sidecar(path)
+    except (OSError, ValueError, KeyError, IndexError, TypeError, struct.error) as e:
+        print(f"Ignoring the parsed log cache of {path}: {e!r}")
+        return None
+
+
+def read_log_sidecar(path):
+    # The columns are views of the mapped sidecar and the payloads are read from the mapped log.
+    try:
+        with open(path + SIDECAR_SUFFIX, 'rb') as file:
+            sidecar = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    header_start = len(SIDECAR_MAGIC) + SIDECAR_LENGTH.size
+    if sidecar[:len(SIDECAR_MAGIC)] != SIDECAR_MAGIC:
+        sidecar.close()
+        return None
+    header_length, = SIDECAR_LENGTH.unpack(sidecar[len(SIDECAR_MAGIC):header_start])
+    header = json.loads(sidecar[header_start:header_start + header_length])
+    if header['version'] != SIDECAR_VERSION or header['signature'] != log_signature(path):
+        sidecar.close()
+        return None
+    data_start = align(header_start + header_length)
+    view = memoryview(sidecar)
+    columns = {}
+    for name, (start, typecode, count) in header['columns'].items():
+        column_start = data_start + start
+        column_end = column_start + count * array(typecode).itemsize
+        if column_end > len(sidecar):
+            raise ValueError(f"column {name} ends at {column_end}, after the end of the sidecar")
+        columns[name] = view[column_start:column_end].cast(typecode)
+    names = [sys.intern(name) for name in header['names']]
+    log = None
+    if header['signature'][0] > 0:
+        with open(path, 'rb') as file:
+            log = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    recorded_events = EventStore()
+    for name_id, timestamp, payload_offset, payload_length in zip(
+            columns['event_name_ids'], columns['event_timestamps'], columns['payload_offsets'],
+            columns['payload_lengths']):
+        recorded_events.append(RecordedEvent(names[name_id], log, payload_offset, payload_offset + payload_length,
+                                             timestamp if timestamp >= 0 else None))
+    restart_events = [RecordedEvent('_app_start', log, payload_offset, payload_offset + payload_length,
+                                    timestamp if timestamp >= 0 else None)
+                      for timestamp, payload_offset, payload_length in zip(
+                          columns['restart_timestamps'], columns['restart_payload_offsets'],
+                          columns['restart_payload_lengths'])]
+    return LogScan(recorded_events, list(columns['submitted_events']), columns['event_offsets'],
+                   columns['batch_offsets'], columns['payload_offsets'], columns['batch_send_times'], restart_events,
+                   columns['restart_offsets'], columns['restart_payload_offsets'])
+
+
+def log_signature(path):
+    # Size, modification time and a hash of samples spread over the log. The samples catch a log that was
+    # rewritten with the same size and time without reading all of it.
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        if stat.st_size <= SIGNATURE_SAMPLES * SIGNATURE_SAMPLE_SIZE:
+            digest.update(file.read())
+        else:
+            step = (stat.st_size - SIGNATURE_SAMPLE_SIZE) // (SIGNATURE_SAMPLES - 1)
+            for sample in range(SIGNATURE_SAMPLES):
+                file.seek(sample * step)
+                digest.update(file.read(SIGNATURE_SAMPLE_SIZE))
+    return [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+
+
+def align(position):
+    return (position + 7) & ~7
+
+
+def iter_log_entries(path, include_restarts=False):
+    # Yields (EVENT_ENTRY, line offset, event name, JSON payload, payload offset) for every saved event and
+    # (BATCH_ENTRY, line offset, event count, send time in milliseconds or None, None) for every "Send N events"
+    # line, in log order. An _app_start that directly follows _app_end or _user_engagement is the app coming back from
+    # background; it is skipped, or yielded as a RESTART_ENTRY when include_restarts is set.
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as log:
+            yield from LogEntryParser(include_restarts).entries(log)
+
+
+class LogEntryParser:
+    # Turns the candidate lines of a buffer into log entries. The last recorded event name is kept between calls,
+    # so a log fed in pieces is parsed exactly like the whole file.
+    def __init__(self, include_restarts=False):
+        self.include_restarts = include_restarts
+        self.current_event_name = ''
+
+    def entries(self, buffer, base_offset=0):
+        for line_start, line_end in iter_candidate_lines(buffer):
+            batch_match = match_batch(buffer, line_start, line_end)
+            if batch_match is not None:
+                sent_at = batch_match.group(2)
+                yield (BATCH_ENTRY, base_offset + line_start, int(batch_match.group(1)),
+                       None if sent_at is None else int(sent_at), None)
+            event_match = match_event(buffer, line_start, line_end)
+            if event_match is None:
+                continue
+            event_name = event_match.group(1).decode('ascii')
+            if event_name == '_app_start' and (
+                    self.current_event_name == '_app_end' or self.current_event_name == '_user_engagement'):
+                if self.include_restarts:
+                    yield (RESTART_ENTRY, base_offset + line_start, event_name, event_match.group(2),
+                           base_offset + event_match.start(2))
+                continue
+            yield (EVENT_ENTRY, base_offset + line_start, event_name, event_match.group(2),
+                   base_offset + event_match.start(2))
+            self.current_event_name = event_name
+
+
+class LogFollower:
+    # Tails an appium.log that is still being written. Each poll() reads only the bytes appended since the last
+    # one and keeps a trailing partial line back until its newline arrives, so no byte is parsed twice. A log that
+    # shrinks was replaced and is followed again from the start, which is counted in restarts.
+    def __init__(self, path, chunk_size=FOLLOW_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.restarts = 0
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self._partial = b''
+        self._parser = LogEntryParser(include_restarts=True)
+        self._builder = LogScanBuilder()
+
+    @property
+    def recorded_events(self):
+        return self._builder.recorded_events
+
+    def poll(self, final=False):
+        # Returns the events recorded since the previous poll. With final set the writer is known to be done and
+        # a last line without newline is parsed as well.
+        new_events = []
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return new_events
+        if size < self.offset:
+            self.restarts += 1
+            self._reset()
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            while True:
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.offset += len(chunk)
+                buffer = self._partial + chunk
+                end = buffer.rfind(b'\n') + 1
+                self._partial = buffer[end:]
+                self._parse(buffer[:end], self.offset - len(buffer), new_events)
+        if final and self._partial:
+            self._parse(self._partial, self.offset - len(self._partial), new_events)
+            self._partial = b''
+        return new_events
+
+    def log_scan(self):
+        return self._builder.log_scan()
+
+    def _parse(self, buffer, base_offset, new_events):
+        for entry in self._parser.entries(buffer, base_offset):
+            event = self._builder.add(*entry)
+            if event is not None:
+                new_events.append(event)
+
+
+def iter_candidate_lines(log):
+    # The literal prefilter: jumps between the "Saved event" and "Send " markers with mmap.find and yields the
+    # (start, end) offsets of the lines holding one of them, so no other line reaches a regex.
+    next_event = log.find(SAVED_EVENT_MARKER)
+    next_batch = log.find(BATCH_MARKER)
+    while next_event != -1 or next_batch != -1:
+        if next_batch == -1 or (next_event != -1 and next_event < next_batch):
+            position = next_event
+        else:
+            position = next_batch
+        line_start = log.rfind(b'\n', 0, position) + 1
+        line_end = log.find(b'\n', position)
+        if line_end == -1:
+            line_end = len(log)
+        yield line_start, line_end
+        if next_event != -1 and next_event < line_end:
+            next_event = log.find(SAVED_EVENT_MARKER, line_end)
+        if next_batch != -1 and next_batch < line_end:
+            next_batch = log.find(BATCH_MARKER, line_end)
+
+
+def match_batch(log, line_start, line_end):
+    if log[line_start:line_start + len(BATCH_MARKER)] != BATCH_MARKER:
+        return None
+    return BATCH_PATTERN.match(log, line_start, line_end)
+
+
+def match_event(log, line_start, line_end):
+    # The first line of every app_event_log block carries the appium prefix, the following ones start with the
+    # event itself. The prefixed form wins when a line holds both, as it always did.
+    position = log.find(FIRST_EVENT_MARKER, line_start, line_end)
+    while position != -1:
+        event_match = EVENT_PATTERN.match(log, position + len(FIRST_EVENT_MARKER) - len(SAVED_EVENT_MARKER), line_end)
+        if event_match is not None:
+            return event_match
+        position = log.find(FIRST_EVENT_MARKER, position + 1, line_end)
+    if log[line_start:line_start + len(SAVED_EVENT_MARKER)] != SAVED_EVENT_MARKER:
+        return None
+    return EVENT_PATTERN.match(log, line_start, line_end)
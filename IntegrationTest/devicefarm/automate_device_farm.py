@@ -11,10 +11,16 @@ OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific
 and limitations under the License.
 """
 import datetime
+import hashlib
+import io
+import json
 import os
 import random
 import string
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
 import boto3
 import requests
@@ -22,141 +28,484 @@ import yaml
 import zipfile
 import shutil
 import re
+from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
 
-# The following script runs a test through Device Farm
-client = boto3.client('devicefarm')
+from event_expectations import ExpectationMatcher, load_expectations
+from follow_verifier import FollowVerifier
+from instrumentation import PIPELINE_REPORT, InstrumentedClient, instrumentation
+from waiter import Waiter
 
+# The following script runs a test through Device Farm. The boto3 client is only created on first use, and
+# set_client swaps in another implementation such as the offline FakeDeviceFarm in fake_devicefarm.py.
+_client = None
+_client_lock = threading.Lock()
 
-def get_config(app_file_path, test_package, project_arn, test_spec_arn, pool_arn):
+MAX_LIST_WORKERS = 4
+MAX_DOWNLOAD_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF_SECONDS = 2
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+UPLOAD_CACHE_FILE = '.df_upload_cache.json'
+UPLOAD_HASH_CHUNK_SIZE = 1024 * 1024
+UPLOAD_POLL_INITIAL_DELAY = 1
+UPLOAD_POLL_MAX_DELAY = 10
+UPLOAD_TIMEOUT = 30 * 60
+RUN_POLL_INITIAL_DELAY = 2
+RUN_POLL_MAX_DELAY = 30
+RUN_TIMEOUT = 3 * 60 * 60
+JUNIT_REPORT_MEMBER = "Host_Machine_Files/$DEVICEFARM_LOG_DIR/junitreport.xml"
+APPIUM_LOG_MEMBER = "Host_Machine_Files/$DEVICEFARM_LOG_DIR/appium.log"
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = InstrumentedClient(boto3.client('devicefarm'), instrumentation)
+        return _client
+
+
+def set_client(devicefarm_client):
+    global _client
+    with _client_lock:
+        _client = None if devicefarm_client is None else InstrumentedClient(devicefarm_client, instrumentation)
+
+
+def get_config(app_file_path, test_package, project_arn, test_spec_arn, pool_arns):
     return {
         # This is our app under test.
         "appFilePath": app_file_path,
         "projectArn": project_arn,
         # Since we care about the most popular devices, we'll use a curated pool.
         "testSpecArn": test_spec_arn,
-        "poolArn": pool_arn,
+        "poolArns": pool_arns,
         "namePrefix": "MyiOSAppTest",
         # This is our test package. This tutorial won't go into how to make these.
         "testPackage": test_package
     }
 
 
-def upload_and_test_ios(app_file_path, test_package, project_arn, test_spec_arn, pool_arn):
-    config = get_config(app_file_path, test_package, project_arn, test_spec_arn, pool_arn)
+def upload_and_test_ios(app_file_path, test_package, project_arn, test_spec_arn, pool_arn, expectations_path=None):
+    upload_and_test_ios_sharded(app_file_path, test_package, project_arn, test_spec_arn, [pool_arn],
+                                expectations_path=expectations_path)
+
+
+def upload_and_test_ios_sharded(app_file_path, test_package, project_arn, test_spec_arn, pool_arns, shard_count=1,
+                                expectations_path=None):
+    # Schedules one run per device pool, or splits a single pool into shard_count pools, polls all runs together
+    # and writes the appium logs of every shard into one ios_path.yaml. With expectations_path, the appium log of
+    # every device is verified as soon as its job is downloaded and all runs are stopped at the first failure.
+    # The timing and byte counts of every phase end up in report/pipeline_metrics.json, even when the runs fail.
+    instrumentation.reset()
+    try:
+        with instrumentation.span('pipeline'):
+            run_ios_pipeline(app_file_path, test_package, project_arn, test_spec_arn, pool_arns, shard_count,
+                             expectations_path)
+    finally:
+        instrumentation.write_report(PIPELINE_REPORT)
+        print(f"Pipeline metrics saved to {PIPELINE_REPORT}")
+
+
+def run_ios_pipeline(app_file_path, test_package, project_arn, test_spec_arn, pool_arns, shard_count,
+                     expectations_path):
+    config = get_config(app_file_path, test_package, project_arn, test_spec_arn, pool_arns)
     print(config)
     unique = config['namePrefix'] + "-" + (datetime.date.today().isoformat()) + (
         ''.join(random.sample(string.ascii_letters, 8)))
     print(f"The unique identifier for this run is going to be {unique} -- all uploads will be prefixed with this.")
 
-    our_upload_arn = upload_df_file(config, unique, config['appFilePath'], "IOS_APP")
-    our_test_package_arn = upload_df_file(config, unique, config['testPackage'], 'APPIUM_PYTHON_TEST_PACKAGE')
+    # Both uploads run side by side and are skipped when the same bytes were already processed by Device Farm.
+    upload_cache = UploadCache()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='df-upload') as executor:
+        app_upload = executor.submit(upload_df_file, config, unique, config['appFilePath'], "IOS_APP",
+                                     upload_cache=upload_cache)
+        test_package_upload = executor.submit(upload_df_file, config, unique, config['testPackage'],
+                                              'APPIUM_PYTHON_TEST_PACKAGE', upload_cache=upload_cache)
+        our_upload_arn = app_upload.result()
+        our_test_package_arn = test_package_upload.result()
     print(our_upload_arn, our_test_package_arn)
-    # Now that we have those out of the way, we can start the test run...
-    response = client.schedule_run(
+
+    verifier = None
+    if expectations_path is not None:
+        verifier = FollowVerifier(ExpectationMatcher(load_expectations(expectations_path)))
+
+    # Both lists are filled while the pools are created and the runs scheduled, so whatever step fails, every pool
+    # created so far is deleted and every run scheduled so far is stopped.
+    temporary_pool_arns = []
+    run_names = {}
+    try:
+        pool_arns = config['poolArns']
+        if len(pool_arns) == 1 and shard_count > 1:
+            with instrumentation.span('split_device_pool'):
+                split_device_pool(config, unique, pool_arns[0], our_upload_arn, shard_count, temporary_pool_arns)
+            pool_arns = temporary_pool_arns
+        # Now that we have those out of the way, we can start the test runs...
+        names = [unique if len(pool_arns) == 1 else f"{unique}-shard{index}" for index in range(1, len(pool_arns) + 1)]
+        with instrumentation.span('schedule'), \
+                ThreadPoolExecutor(max_workers=len(pool_arns), thread_name_prefix='df-schedule') as executor:
+            run_futures = [executor.submit(schedule_test_run, config, name, pool_arn, our_upload_arn,
+                                           our_test_package_arn) for name, pool_arn in zip(names, pool_arns)]
+        schedule_errors = []
+        for name, run_future in zip(names, run_futures):
+            try:
+                run_arn = run_future.result()
+            except Exception as e:
+                print(f"Couldn't schedule run {name}: {e}")
+                schedule_errors.append(e)
+                continue
+            run_names[run_arn] = name
+            print(f"Run {name} is scheduled as arn {run_arn} ")
+        if schedule_errors:
+            stop_runs(run_names)
+            raise schedule_errors[0]
+        start_time = datetime.datetime.now()
+
+        with ExitStack() as stack:
+            downloaders = {}
+            for run_arn, name in run_names.items():
+                # Save the output somewhere. We're using the unique value, but you could use something else
+                save_path = os.path.join(os.getcwd(), name)
+                os.mkdir(save_path)
+                downloaders[run_arn] = stack.enter_context(ArtifactDownloader(
+                    save_path, on_appium_log=verifier.verify_finished_log if verifier is not None else None))
+            try:
+                # Artifacts of every device are pulled as soon as its job completes.
+                states = wait_for_runs(
+                    run_names, on_job_finished=lambda run_arn, job: downloaders[run_arn].submit_job(job),
+                    stop_reason=(lambda: verifier.first_failure) if verifier is not None else None)
+            except Exception as e:
+                # If something goes wrong in this process, we stop the runs and exit.
+                print(e)
+                stop_runs(run_names)
+                exit(1)
+            print(f"Tests finished in state {', '.join(set(states.values()))} after "
+                  + str(datetime.datetime.now() - start_time))
+            appium_log_path = []
+            for run_arn, downloader in downloaders.items():
+                # now, we pull the logs of the jobs that were not reported as completed while polling.
+                for job in get_client().list_jobs(arn=run_arn)['jobs']:
+                    downloader.submit_job(job)
+                appium_log_path.extend(downloader.appium_log_paths())
+    finally:
+        delete_device_pools(temporary_pool_arns)
+    # Save the last run information
+    save_appium_log_path(appium_log_path)
+    # done
+    print("Finished")
+
+
+def schedule_test_run(config, name, pool_arn, app_arn, test_package_arn):
+    response = get_client().schedule_run(
         projectArn=config["projectArn"],
-        appArn=our_upload_arn,
-        devicePoolArn=config["poolArn"],
-        name=unique,
+        appArn=app_arn,
+        devicePoolArn=pool_arn,
+        name=name,
         test={
             "type": "APPIUM_PYTHON",
             "testSpecArn": config["testSpecArn"],
-            "testPackageArn": our_test_package_arn
+            "testPackageArn": test_package_arn
         }
     )
-    run_arn = response['run']['arn']
-    start_time = datetime.datetime.now()
-    print(f"Run {unique} is scheduled as arn {run_arn} ")
+    return response['run']['arn']
 
-    try:
-        while True:
-            response = client.get_run(arn=run_arn)
-            state = response['run']['status']
-            if state == 'COMPLETED' or state == 'ERRORED':
-                break
-            else:
-                print(f" Run {unique} in state {state}, total time " + str(datetime.datetime.now() - start_time))
-                time.sleep(10)
-    except Exception as e:
-        # If something goes wrong in this process, we stop the run and exit.
-        print(e)
-        client.stop_run(arn=run_arn)
-        exit(1)
-    print(f"Tests finished in state {state} after " + str(datetime.datetime.now() - start_time))
-    # now, we pull all the logs.
-    jobs_response = client.list_jobs(arn=run_arn)
-    # Save the output somewhere. We're using the unique value, but you could use something else
-    save_path = os.path.join(os.getcwd(), unique)
-    os.mkdir(save_path)
-    # Save the last run information
-    appium_log_path = download_artifacts(jobs_response, save_path)
-    save_appium_log_path(appium_log_path)
-    # done
-    print("Finished")
+
+def split_device_pool(config, unique, pool_arn, app_arn, shard_count, shard_pool_arns):
+    # Device Farm cannot shard a pool by itself, so the devices of the pool that are compatible with the app are
+    # dealt round-robin into shard_count temporary pools, which are deleted again once the runs are done. Every
+    # pool is appended to the caller's shard_pool_arns as soon as it exists, so a failure halfway loses none.
+    devices = get_client().list_device_pool_compatibility(devicePoolArn=pool_arn, appArn=app_arn,
+                                                          testType='APPIUM_PYTHON')['compatibleDevices']
+    device_arns = [device['device']['arn'] for device in devices]
+    if not device_arns:
+        raise Exception(f"Device pool {pool_arn} has no device compatible with {app_arn}")
+    shard_count = min(shard_count, len(device_arns))
+    for index in range(shard_count):
+        shard_device_arns = device_arns[index::shard_count]
+        response = get_client().create_device_pool(
+            projectArn=config['projectArn'],
+            name=f"{unique}-shard{index + 1}",
+            rules=[{'attribute': 'ARN', 'operator': 'IN', 'value': json.dumps(shard_device_arns)}],
+            maxDevices=len(shard_device_arns)
+        )
+        shard_pool_arns.append(response['devicePool']['arn'])
+        print(f"Created device pool {response['devicePool']['name']} with {len(shard_device_arns)} devices")
+    return shard_pool_arns
+
+
+def stop_runs(run_arns):
+    for run_arn in run_arns:
+        try:
+            get_client().stop_run(arn=run_arn)
+        except ClientError as e:
+            print(f"Couldn't stop run {run_arn}: {e}")
 
 
-def upload_df_file(config, unique, filename, type_, mime='application/octet-stream'):
-    response = client.create_upload(projectArn=config['projectArn'],
-                                    name=unique + "_" + os.path.basename(filename),
-                                    type=type_,
-                                    contentType=mime
-                                    )
+def delete_device_pools(pool_arns):
+    for pool_arn in pool_arns:
+        try:
+            get_client().delete_device_pool(arn=pool_arn)
+        except ClientError as e:
+            print(f"Couldn't delete device pool {pool_arn}: {e}")
+
+
+def upload_df_file(config, unique, filename, type_, mime='application/octet-stream', upload_cache=None):
+    if upload_cache is not None:
+        cache_key = upload_cache.key(config['projectArn'], type_, filename)
+        cached_upload_arn = upload_cache.lookup(cache_key)
+        if cached_upload_arn is not None:
+            print(f"Reusing upload {cached_upload_arn} for unchanged {filename}")
+            instrumentation.count('upload_cache_hits')
+            return cached_upload_arn
+    response = get_client().create_upload(projectArn=config['projectArn'],
+                                          name=unique + "_" + os.path.basename(filename),
+                                          type=type_,
+                                          contentType=mime
+                                          )
     # Get the upload ARN, which we'll return later.
     upload_arn = response['upload']['arn']
     # We're going to extract the URL of the upload and use Requests to upload it
     upload_url = response['upload']['url']
-    with open(filename, 'rb') as file_stream:
+    with open(filename, 'rb') as file_stream, instrumentation.span('upload', file=os.path.basename(filename)):
         print(f"Uploading {filename} to Device Farm as {response['upload']['name']}... ", end='')
         put_req = requests.put(upload_url, data=file_stream, headers={"content-type": mime})
         print(' done')
         if not put_req.ok:
             raise Exception("Couldn't upload, requests said we're not ok. Requests says: " + put_req.reason)
+    instrumentation.count('http_bytes_uploaded', os.path.getsize(filename))
     started = datetime.datetime.now()
-    while True:
-        print(f"Upload of {filename} in state {response['upload']['status']} after " + str(
-            datetime.datetime.now() - started))
-        if response['upload']['status'] == 'FAILED':
+
+    def upload_processed(upload):
+        print(f"Upload of {filename} in state {upload['status']} after " + str(datetime.datetime.now() - started))
+        if upload['status'] == 'FAILED':
             raise Exception("The upload failed processing. DeviceFarm says reason is: \n" + (
-                response['upload']['message'] if 'message' in response['upload'] else response['upload']['metadata']))
-        if response['upload']['status'] == 'SUCCEEDED':
-            break
-        time.sleep(5)
-        response = client.get_upload(arn=upload_arn)
+                upload['message'] if 'message' in upload else upload['metadata']))
+        return upload['status'] == 'SUCCEEDED'
+
+    if not upload_processed(response['upload']):
+        waiter = Waiter(initial_delay=UPLOAD_POLL_INITIAL_DELAY, max_delay=UPLOAD_POLL_MAX_DELAY,
+                        timeout=UPLOAD_TIMEOUT)
+        with instrumentation.span('upload_processing', file=os.path.basename(filename)):
+            waiter.wait_until(
+                lambda: True if upload_processed(get_client().get_upload(arn=upload_arn)['upload']) else None,
+                f"processing of {filename}")
     print("")
+    if upload_cache is not None:
+        upload_cache.store(cache_key, upload_arn)
     return upload_arn
 
 
+def wait_for_runs(run_names, on_job_finished=None, stop_reason=None):
+    # Polls every run in run_names (run ARN to run name) in one loop with backoff, and calls
+    # on_job_finished(run_arn, job) as soon as a job completes, so its artifacts can be fetched while the other
+    # devices are still running. Raises once stop_reason() returns a reason. Returns the final state of each run.
+    start_time = datetime.datetime.now()
+    finished_job_arns = set()
+    states = {}
+
+    def poll_runs():
+        reason = stop_reason() if stop_reason is not None else None
+        if reason:
+            raise Exception(f"Stopping the runs early: {reason}")
+        for run_arn, name in run_names.items():
+            if run_arn in states:
+                continue
+            state = get_client().get_run(arn=run_arn)['run']['status']
+            jobs = get_client().list_jobs(arn=run_arn)['jobs']
+            for job in jobs:
+                if job['status'] == 'COMPLETED' and job['arn'] not in finished_job_arns:
+                    finished_job_arns.add(job['arn'])
+                    print(f" Job {job['name']} of {name} completed with result {job.get('result')} after " + str(
+                        datetime.datetime.now() - start_time))
+                    record_job_execution(name, job)
+                    if on_job_finished is not None:
+                        on_job_finished(run_arn, job)
+            if state == 'COMPLETED' or state == 'ERRORED':
+                states[run_arn] = state
+                print(f" Run {name} finished in state {state} after " + str(datetime.datetime.now() - start_time))
+            else:
+                completed = sum(1 for job in jobs if job['arn'] in finished_job_arns)
+                print(f" Run {name} in state {state}, {completed}/{len(jobs)} jobs completed, total time "
+                      + str(datetime.datetime.now() - start_time))
+        return states if len(states) == len(run_names) else None
+
+    waiter = Waiter(initial_delay=RUN_POLL_INITIAL_DELAY, max_delay=RUN_POLL_MAX_DELAY, timeout=RUN_TIMEOUT)
+    with instrumentation.span('run_execution', runs=len(run_names)):
+        return waiter.wait_until(poll_runs, "runs " + ", ".join(run_names.values()))
+
+
+def record_job_execution(run_name, job):
+    # Device Farm reports when the job started and stopped on the device and the device minutes it used, which
+    # is more exact than anything the polling interval allows.
+    started, stopped = job.get('started'), job.get('stopped')
+    if started is None or stopped is None:
+        return
+    device_minutes = job.get('deviceMinutes', {}).get('total')
+    instrumentation.record_span('job_execution', (stopped - started).total_seconds(), run=run_name,
+                                device=job['name'], result=job.get('result'), device_minutes=device_minutes)
+    if device_minutes is not None:
+        instrumentation.count('device_minutes', device_minutes)
+
+
+class UploadCache:
+    # Persists a map from (project, upload type, sha256 of the file) to the ARN of an upload that Device Farm
+    # already processed successfully. A cached ARN is only reused after get_upload confirms it still SUCCEEDED.
+    def __init__(self, path=UPLOAD_CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r') as file:
+                self._entries = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    @staticmethod
+    def key(project_arn, type_, filename):
+        return f"{project_arn}|{type_}|{file_sha256(filename)}"
+
+    def lookup(self, key):
+        with self._lock:
+            upload_arn = self._entries.get(key)
+        if upload_arn is None:
+            return None
+        try:
+            status = get_client().get_upload(arn=upload_arn)['upload']['status']
+        except ClientError as e:
+            print(f"Cached upload {upload_arn} is no longer available: {e}")
+            status = None
+        if status == 'SUCCEEDED':
+            return upload_arn
+        self._remove(key)
+        return None
+
+    def store(self, key, upload_arn):
+        with self._lock:
+            self._entries[key] = upload_arn
+            self._save()
+
+    def _remove(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self._entries, file, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+def file_sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(UPLOAD_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def download_artifacts(jobs_response, save_path):
-    logcat_paths = []
-    for job in jobs_response['jobs']:
-        # Make a directory for our information
-        job_name = job['name']
-        os.makedirs(os.path.join(save_path, job_name), exist_ok=True)
-        # Get each suite within the job
-        suites = client.list_suites(arn=job['arn'])['suites']
-        for suite in suites:
-            if suite['name'] == 'Tests Suite':
-                for test in client.list_tests(arn=suite['arn'])['tests']:
-                    # Get the artifacts
-                    for artifact_type in ['FILE', 'SCREENSHOT', 'LOG']:
-                        artifacts = client.list_artifacts(
-                            type=artifact_type,
-                            arn=test['arn']
-                        )['artifacts']
-                        for artifact in artifacts:
-                            # We replace : because it has a special meaning in Windows & macos
-                            path_to = os.path.join(save_path, job_name)
-                            os.makedirs(path_to, exist_ok=True)
-                            filename = artifact['type'] + "_" + artifact['name'] + "." + artifact['extension']
-                            if str(filename).endswith(".zip"):
-                                artifact_save_path = os.path.join(path_to, filename)
-                                print("Downloading " + artifact_save_path)
-                                with open(artifact_save_path, 'wb') as fn, requests.get(artifact['url'],
-                                                                                        allow_redirects=True) as request:
-                                    fn.write(request.content)
-                                appium_log_path = unzip_and_copy(artifact_save_path)
-                                if appium_log_path is not None:
-                                    logcat_paths.append(appium_log_path)
-    return logcat_paths
+    with ArtifactDownloader(save_path) as downloader:
+        for job in jobs_response['jobs']:
+            downloader.submit_job(job)
+        return downloader.appium_log_paths()
+
+
+class ArtifactDownloader:
+    # Lists and downloads the artifacts of Device Farm jobs on two bounded thread pools, so the listing of one
+    # job overlaps with the downloads of the others. Zips are streamed to disk over one pooled HTTP session.
+    def __init__(self, save_path, list_workers=MAX_LIST_WORKERS, download_workers=MAX_DOWNLOAD_WORKERS,
+                 on_appium_log=None):
+        self.save_path = save_path
+        self.on_appium_log = on_appium_log
+        self._list_executor = ThreadPoolExecutor(max_workers=list_workers, thread_name_prefix='df-list')
+        self._download_executor = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix='df-download')
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=download_workers, pool_maxsize=download_workers)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._job_futures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._list_executor.shutdown(wait=True)
+        self._download_executor.shutdown(wait=True)
+        self._session.close()
+
+    def submit_job(self, job):
+        # A job is only listed once, however often it is submitted.
+        if job['arn'] not in self._job_futures:
+            self._job_futures[job['arn']] = self._list_executor.submit(self._list_job_artifacts, job)
+
+    def appium_log_paths(self):
+        # Results are collected in the order the jobs were submitted.
+        logcat_paths = []
+        for job_future in self._job_futures.values():
+            for download_future in job_future.result():
+                appium_log_path = download_future.result()
+                if appium_log_path is not None:
+                    logcat_paths.append(appium_log_path)
+        return logcat_paths
+
+    def _list_job_artifacts(self, job):
+        with instrumentation.span('artifact_listing', device=job['name']):
+            # Make a directory for our information
+            path_to = os.path.join(self.save_path, job['name'])
+            os.makedirs(path_to, exist_ok=True)
+            download_futures = []
+            # Get each suite within the job
+            suites = get_client().list_suites(arn=job['arn'])['suites']
+            for suite in suites:
+                if suite['name'] == 'Tests Suite':
+                    for test in get_client().list_tests(arn=suite['arn'])['tests']:
+                        # Get the artifacts
+                        for artifact_type in ['FILE', 'SCREENSHOT', 'LOG']:
+                            artifacts = get_client().list_artifacts(
+                                type=artifact_type,
+                                arn=test['arn']
+                            )['artifacts']
+                            for artifact in artifacts:
+                                filename = artifact['type'] + "_" + artifact['name'] + "." + artifact['extension']
+                                if str(filename).endswith(".zip"):
+                                    artifact_save_path = os.path.join(path_to, filename)
+                                    download_futures.append(self._download_executor.submit(
+                                        self._download_and_unzip, artifact['url'], artifact_save_path))
+            return download_futures
+
+    def _download_and_unzip(self, url, artifact_save_path):
+        print("Downloading " + artifact_save_path)
+        with instrumentation.span('download', device=os.path.basename(os.path.dirname(artifact_save_path))):
+            download_file(self._session, url, artifact_save_path)
+        with instrumentation.span('extraction', device=os.path.basename(os.path.dirname(artifact_save_path))):
+            appium_log_path = unzip_and_copy(artifact_save_path)
+        if appium_log_path is not None and self.on_appium_log is not None:
+            self.on_appium_log(appium_log_path)
+        return appium_log_path
+
+
+def download_file(session, url, save_path, retries=DOWNLOAD_RETRIES):
+    # Streams the response to a partial file in chunks and only moves it into place once it is complete.
+    partial_path = save_path + ".part"
+    for attempt in range(1, retries + 1):
+        try:
+            with session.get(url, allow_redirects=True, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                with open(partial_path, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+                        instrumentation.count('http_bytes_downloaded', len(chunk))
+                        instrumentation.count('disk_bytes_written', len(chunk))
+            os.replace(partial_path, save_path)
+            return
+        except requests.RequestException as e:
+            if attempt == retries:
+                raise
+            delay = DOWNLOAD_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            print(f"Download of {save_path} failed ({e}), retry {attempt}/{retries - 1} in {delay}s")
+            time.sleep(delay)
 
 
 def save_appium_log_path(appium_log_paths):
@@ -165,11 +514,13 @@ def save_appium_log_path(appium_log_paths):
         print("appium log paths saved successful")
 
 
-def unzip_and_copy(zip_path):
+def unzip_and_copy(zip_path, extract_all=False):
+    if not extract_all:
+        return extract_verifier_files(zip_path)
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
         zip_ref.extractall(os.path.dirname(zip_path))
 
-    origin_path = os.path.dirname(zip_path) + "/Host_Machine_Files/$DEVICEFARM_LOG_DIR/junitreport.xml"
+    origin_path = os.path.dirname(zip_path) + "/" + JUNIT_REPORT_MEMBER
     device_name = os.path.basename(os.path.dirname(zip_path))
     rename_path = os.path.dirname(origin_path) + "/" + device_name + " junitreport.xml"
     appium_log_path = os.path.dirname(origin_path) + "/appium.log"
@@ -187,3 +538,41 @@ def unzip_and_copy(zip_path):
         return appium_log_path
     else:
         return None
+
+
+def extract_verifier_files(zip_path):
+    # Streams only junitreport.xml and appium.log out of the device zip and leaves videos, screenshots and the
+    # rest of the host machine files inside the archive. The JUnit report is renamed for the device while it
+    # is copied, with the same paths the full extraction produces.
+    log_dir = os.path.dirname(zip_path) + "/" + os.path.dirname(JUNIT_REPORT_MEMBER)
+    device_name = os.path.basename(os.path.dirname(zip_path))
+    rename_path = log_dir + "/" + device_name + " junitreport.xml"
+    appium_log_path = log_dir + "/appium.log"
+    report_path = os.path.dirname(os.path.dirname(os.path.dirname(zip_path))) + "/report/"
+    extracted_bytes = 0
+    skipped_bytes = 0
+    has_report = False
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for member in zip_ref.infolist():
+            member_name = member.filename.removeprefix("./")
+            if member_name == JUNIT_REPORT_MEMBER:
+                os.makedirs(report_path, exist_ok=True)
+                os.makedirs(log_dir, exist_ok=True)
+                with io.TextIOWrapper(zip_ref.open(member), encoding='utf-8') as source, \
+                        open(rename_path, 'w', encoding='utf-8') as device_report, \
+                        open(report_path + os.path.basename(rename_path), 'w', encoding='utf-8') as report:
+                    for line in source:
+                        device_report.write(line)
+                        report.write(re.sub(r'\bTestShopping\b', "Appium " + device_name, line))
+                has_report = True
+            elif member_name == APPIUM_LOG_MEMBER:
+                os.makedirs(log_dir, exist_ok=True)
+                with zip_ref.open(member) as source, open(appium_log_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, EXTRACT_CHUNK_SIZE)
+            else:
+                skipped_bytes += member.file_size
+                continue
+            extracted_bytes += member.file_size
+    print(f"Extracted {extracted_bytes} bytes and skipped {skipped_bytes} bytes of {zip_path}")
+    instrumentation.count('disk_bytes_written', extracted_bytes)
+    return appium_log_path if has_report else None
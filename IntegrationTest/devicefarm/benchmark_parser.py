@@ -0,0 +1,182 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import argparse
+import json
+import mmap
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import appium_log
+from instrumentation import peak_rss_bytes
+from log_generator import generate_appium_log, parse_size
+
+# Measures how the appium.log parser scales: events/sec and MB/sec of scan_log, which extracts the recorded events
+# and uploaded batches in one pass, the time spent in each parsing stage, the write and reload time of the sidecar
+# cache and the peak memory of a parse.
+# Example: python benchmark_parser.py --size 200MB --json parser.json --baseline previous.json
+
+
+def benchmark_log(path, repeat):
+    size = os.path.getsize(path)
+    seconds = min(timed(appium_log.scan_log, path) for _ in range(repeat))
+    log_scan = appium_log.scan_log(path)
+    results = {
+        'log_bytes': size,
+        'log_scan': {
+            'recorded_events': len(log_scan.recorded_events),
+            'submitted_batches': len(log_scan.submitted_events),
+            'seconds': round(seconds, 4),
+            'events_per_second': round(len(log_scan.recorded_events) / seconds),
+            'megabytes_per_second': round(size / seconds / 1024 / 1024, 1),
+        },
+        'stages': measure_stages(path),
+        'sidecar': measure_sidecar(path, log_scan, repeat),
+        'peak_traced_bytes': traced_peak(appium_log.scan_log, path),
+    }
+    results['peak_traced_bytes_per_event'] = round(
+        results['peak_traced_bytes'] / max(len(log_scan.recorded_events), 1))
+    results['peak_rss_bytes'] = peak_rss_bytes()
+    return results
+
+
+def timed(parser, path):
+    started = time.perf_counter()
+    parser(path)
+    return time.perf_counter() - started
+
+
+def measure_sidecar(path, log_scan, repeat):
+    # Writes the sidecar cache of the log once and times how fast a later run gets the scan back from it.
+    started = time.perf_counter()
+    appium_log.write_log_sidecar(path, log_scan)
+    write_seconds = time.perf_counter() - started
+    reload_seconds = min(timed(appium_log.load_log_sidecar, path) for _ in range(repeat))
+    return {
+        'bytes': os.path.getsize(path + appium_log.SIDECAR_SUFFIX),
+        'write_seconds': round(write_seconds, 4),
+        'reload_seconds': round(reload_seconds, 4),
+    }
+
+
+def measure_stages(path):
+    # Walks the same stages as scan_log with a clock around each one. The clock calls add a little overhead to
+    # every stage, so compare these numbers with each other rather than with the end-to-end time.
+    clock = time.perf_counter
+    scan_seconds = regex_seconds = decode_seconds = 0.0
+    lines = 0
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as log:
+        lines_iterator = appium_log.iter_candidate_lines(log)
+        while True:
+            started = clock()
+            line = next(lines_iterator, None)
+            scanned = clock()
+            scan_seconds += scanned - started
+            if line is None:
+                break
+            lines += 1
+            appium_log.match_batch(log, *line)
+            event_match = appium_log.match_event(log, *line)
+            matched = clock()
+            regex_seconds += matched - scanned
+            if event_match is not None:
+                json.loads(event_match.group(2))
+                decode_seconds += clock() - matched
+    return {
+        'candidate_lines': lines,
+        'line_scan_seconds': round(scan_seconds, 4),
+        'regex_seconds': round(regex_seconds, 4),
+        'json_decode_seconds': round(decode_seconds, 4),
+    }
+
+
+def traced_peak(parser, path):
+    # Peak of the Python heap while parsing, which is what grows with the log. The memory mapped file itself is
+    # page cache and does not show up here.
+    tracemalloc.start()
+    try:
+        result = parser(path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    current = results['log_scan']['megabytes_per_second']
+    previous = baseline.get('log_scan', {}).get('megabytes_per_second')
+    if previous and current < previous * (1 - tolerance):
+        regressions.append(f"log scan: {current} MB/s, baseline {previous} MB/s")
+    # Memory is compared per recorded event, so baselines taken on logs of another size stay comparable.
+    current_peak = results['peak_traced_bytes_per_event']
+    previous_peak = baseline.get('peak_traced_bytes_per_event')
+    if previous_peak and current_peak > previous_peak * (1 + tolerance):
+        regressions.append(f"peak traced memory: {current_peak} bytes/event, baseline {previous_peak} bytes/event")
+    return regressions
+
+
+def print_results(results):
+    print(f"log size: {results['log_bytes']} bytes")
+    result = results['log_scan']
+    print(f"log scan: {result['recorded_events']} events and {result['submitted_batches']} batches in "
+          f"{result['seconds']}s, {result['events_per_second']} events/s, {result['megabytes_per_second']} MB/s")
+    stages = results['stages']
+    print(f"stages over {stages['candidate_lines']} candidate lines: line scan {stages['line_scan_seconds']}s, "
+          f"regex {stages['regex_seconds']}s, json decode {stages['json_decode_seconds']}s")
+    sidecar = results['sidecar']
+    print(f"sidecar cache: {sidecar['bytes']} bytes, written in {sidecar['write_seconds']}s, "
+          f"reloaded in {sidecar['reload_seconds']}s")
+    print(f"peak traced memory: {results['peak_traced_bytes']} bytes "
+          f"({results['peak_traced_bytes_per_event']} bytes/event), peak rss: {results['peak_rss_bytes']} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the appium.log parsers of logcat_test.py.")
+    parser.add_argument('--log', help="benchmark an existing appium.log instead of a generated one")
+    parser.add_argument('--size', type=parse_size, default=parse_size('50MB'), help="size of the generated log")
+    parser.add_argument('--noise', type=float, default=4.0, help="appium noise lines per event in the generated log")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the generated log")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per parser, the fastest one is reported")
+    parser.add_argument('--json', dest='json_path', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown or memory growth against the baseline, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    if args.log:
+        results = benchmark_log(args.log, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory(prefix='appium-log-benchmark-') as work_dir:
+            path = os.path.join(work_dir, 'appium.log')
+            generated = generate_appium_log(path, target_size=args.size, noise=args.noise, seed=args.seed)
+            print(f"Generated {generated['bytes']} bytes with {generated['events']} events")
+            results = benchmark_log(path, args.repeat)
+    print_results(results)
+    if args.json_path:
+        with open(args.json_path, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import automate_device_farm
+from fake_devicefarm import FakeDeviceFarm
+
+# Runs upload_and_test_ios end to end against FakeDeviceFarm and reports where the time, API calls and bytes go.
+# Example: python benchmark_pipeline.py --devices 20 --api-latency 0.05 --job-duration 5 --artifact-size 20
+
+
+def run_benchmark(devices, api_latency, upload_processing_time, job_duration, job_duration_spread, artifact_size,
+                  upload_size, shards, throttle_rate, work_dir):
+    fake = FakeDeviceFarm(device_count=devices, api_latency=api_latency,
+                          upload_processing_time=upload_processing_time, job_duration=job_duration,
+                          job_duration_spread=job_duration_spread, artifact_padding=artifact_size,
+                          throttle_rate=throttle_rate, seed=0)
+    automate_device_farm.set_client(fake)
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        for filename in ['ModerneShopping.ipa', 'test_bundle.zip']:
+            with open(filename, 'wb') as file:
+                file.write(os.urandom(upload_size))
+        started = time.perf_counter()
+        automate_device_farm.upload_and_test_ios_sharded('ModerneShopping.ipa', 'test_bundle.zip',
+                                                         'arn:aws:devicefarm:us-west-2:000000000000:project:fake',
+                                                         'arn:aws:devicefarm:us-west-2:000000000000:upload:spec',
+                                                         ['arn:aws:devicefarm:us-west-2:000000000000:devicepool:fake'],
+                                                         shard_count=shards)
+        elapsed = time.perf_counter() - started
+    finally:
+        os.chdir(previous_dir)
+        automate_device_farm.set_client(None)
+        fake.close()
+    return {
+        'devices': devices,
+        'shards': shards,
+        'elapsed_seconds': round(elapsed, 3),
+        'api_calls': fake.api_call_count(),
+        'api_calls_by_operation': dict(sorted(fake.calls.items())),
+        'bytes_uploaded': fake.server.bytes_uploaded,
+        'bytes_downloaded': fake.server.bytes_downloaded,
+        'bytes_on_disk': directory_size(work_dir),
+    }
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            total += os.path.getsize(os.path.join(root, filename))
+    return total
+
+
+def print_result(result):
+    print(f"devices: {result['devices']}, shards: {result['shards']}")
+    print(f"end-to-end time: {result['elapsed_seconds']}s")
+    print(f"api calls: {result['api_calls']}")
+    for operation, count in result['api_calls_by_operation'].items():
+        print(f"  {operation}: {count}")
+    print(f"bytes uploaded: {result['bytes_uploaded']}, bytes downloaded: {result['bytes_downloaded']}, "
+          f"bytes on disk: {result['bytes_on_disk']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Device Farm pipeline against an offline fake.")
+    parser.add_argument('--devices', type=int, default=5, help="number of devices in the pool")
+    parser.add_argument('--shards', type=int, default=1, help="number of runs the pool is split into")
+    parser.add_argument('--api-latency', type=float, default=0.02, help="seconds added to every API call")
+    parser.add_argument('--upload-processing-time', type=float, default=1.0,
+                        help="seconds Device Farm takes to process an upload")
+    parser.add_argument('--job-duration', type=float, default=3.0, help="seconds every device job runs")
+    parser.add_argument('--job-duration-spread', type=float, default=2.0,
+                        help="random extra seconds added to each job")
+    parser.add_argument('--artifact-size', type=int, default=5, help="MiB of video padding in each device zip")
+    parser.add_argument('--upload-size', type=int, default=1, help="MiB of the app and test package uploads")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="share of API calls that are throttled")
+    parser.add_argument('--json', dest='json_path', help="also write the result to this JSON file")
+    parser.add_argument('--keep', action='store_true', help="keep the working directory with the artifacts")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='devicefarm-benchmark-')
+    try:
+        result = run_benchmark(args.devices, args.api_latency, args.upload_processing_time, args.job_duration,
+                               args.job_duration_spread, args.artifact_size * 1024 * 1024,
+                               args.upload_size * 1024 * 1024, args.shards, args.throttle_rate, work_dir)
+    finally:
+        if args.keep:
+            print(f"Artifacts kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print_result(result)
+    if args.json_path:
+        with open(args.json_path, 'w') as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import json
+import os
+
+import pytest
+
+from appium_log import CacheInfo, parsed_log_cache
+from instrumentation import (LOGCAT_REPORT, PIPELINE_REPORT, instrumentation, merge_reports, report_properties,
+                             write_report)
+
+LOGCAT_TEST_FILE = 'logcat_test.py'
+
+worker_cache_infos = {}
+worker_instrumentation_reports = {}
+
+
+def pytest_configure(config):
+    # Registered here as well so the marker is known when pytest-xdist is not installed.
+    config.addinivalue_line("markers", "xdist_group(name): run all tests of the group on the same xdist worker")
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    # Every test is one assertion group; expectation rules are named after their rule.
+    callspec = getattr(item, "callspec", None)
+    rule = callspec.params.get("rule") if callspec is not None else None
+    with instrumentation.span('assertion_group', group=rule.name if rule is not None else item.originalname,
+                              path=callspec.params.get("path") if callspec is not None else None):
+        yield
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_sessionfinish(session):
+    # On an xdist worker, hand the cache statistics and metrics to the controller through workeroutput. The
+    # controller writes the metrics report and adds its totals, and those of the Device Farm pipeline, to the
+    # JUnit report before the junitxml plugin writes it. Sessions that run no logcat test, e.g. only
+    # follow_verifier_test.py, write no report unless a JUnit report is requested.
+    if hasattr(session.config, "workeroutput"):
+        session.config.workeroutput["parsed_log_cache"] = tuple(parsed_log_cache.cache_info())
+        if runs_logcat_tests(session):
+            session.config.workeroutput["instrumentation"] = json.dumps(instrumentation.report())
+        return
+    if worker_instrumentation_reports:
+        report = merge_reports(worker_instrumentation_reports)
+    elif runs_logcat_tests(session) or session.config.getoption("xmlpath", None):
+        report = instrumentation.report()
+    else:
+        return
+    write_report(report, LOGCAT_REPORT)
+    properties = report_properties(report, 'logcat')
+    if os.path.exists(PIPELINE_REPORT):
+        with open(PIPELINE_REPORT, 'r') as file:
+            properties.extend(report_properties(json.load(file), 'pipeline'))
+    for junit_xml in junit_xml_reporters(session.config):
+        for name, value in properties:
+            junit_xml.add_global_property(name, value)
+
+
+def runs_logcat_tests(session):
+    return any(item.path.name == LOGCAT_TEST_FILE for item in session.items)
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    workeroutput = getattr(node, "workeroutput", {})
+    cache_info = workeroutput.get("parsed_log_cache")
+    if cache_info is not None:
+        worker_cache_infos[node.gateway.id] = CacheInfo(*cache_info)
+    report = workeroutput.get("instrumentation")
+    if report is not None:
+        worker_instrumentation_reports[node.gateway.id] = json.loads(report)
+
+
+def junit_xml_reporters(config):
+    # The plugin behind --junitxml, which record_testsuite_property writes to as well. It only exists on the
+    # controller, which is why the properties are added here instead of through that fixture on the workers.
+    return [plugin for plugin in config.pluginmanager.get_plugins() if hasattr(plugin, "add_global_property")]
+
+
+def pytest_terminal_summary(terminalreporter):
+    terminalreporter.write_sep("-", "parsed appium log cache")
+    if worker_cache_infos:
+        for worker_id, cache_info in sorted(worker_cache_infos.items()):
+            terminalreporter.write_line(f"{worker_id}: {format_cache_info(cache_info)}")
+        cache_info = CacheInfo(*(sum(values) for values in zip(*worker_cache_infos.values())))
+        terminalreporter.write_line(f"total: {format_cache_info(cache_info)}")
+    else:
+        terminalreporter.write_line(format_cache_info(parsed_log_cache.cache_info()))
+
+
+def format_cache_info(cache_info):
+    return f"hits: {cache_info.hits}, misses: {cache_info.misses}, cached logs: {cache_info.size}"
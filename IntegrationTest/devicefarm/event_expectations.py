@@ -0,0 +1,216 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+from collections import deque
+
+import yaml
+
+SELECTIONS = {'first': 0, 'last': -1}
+FIELD_SECTIONS = ('attributes', 'user')
+FIELD_CHECKS = ('has', 'lacks', 'equals', 'greater_than')
+MISSING = object()
+
+
+class ExpectationError(Exception):
+    pass
+
+
+class ExpectationRule:
+    # One entry of expectations.yaml: which events it selects (an exact event name or a name prefix), which of
+    # them is checked (first, last, a list index or all) and what must hold for the attributes, user and items of
+    # the checked event.
+    def __init__(self, name, event=None, prefix=None, select='first', min_count=1, attributes=None, user=None,
+                 has_items=False):
+        if (event is None) == (prefix is None):
+            raise ExpectationError(f"{name}: set exactly one of event and prefix")
+        if select != 'all' and select not in SELECTIONS and not isinstance(select, int):
+            raise ExpectationError(f"{name}: select must be first, last, all or a list index, not {select!r}")
+        self.name = name
+        self.event = event
+        self.prefix = prefix
+        self.select = select
+        self.index = SELECTIONS.get(select, select)
+        self.min_count = min_count
+        self.fields = {}
+        for section, checks in (('attributes', attributes), ('user', user)):
+            if not checks:
+                continue
+            unknown = set(checks) - set(FIELD_CHECKS)
+            if unknown:
+                raise ExpectationError(f"{name}: unknown {section} checks {sorted(unknown)}")
+            self.fields[section] = checks
+        self.has_items = has_items
+
+    @classmethod
+    def from_dict(cls, spec):
+        try:
+            return cls(**spec)
+        except TypeError as e:
+            raise ExpectationError(f"{spec.get('name', spec)}: {e}")
+
+    @property
+    def target(self):
+        return self.event if self.event is not None else self.prefix + '*'
+
+    def selects(self, event_name):
+        if self.event is not None:
+            return event_name == self.event
+        return event_name.startswith(self.prefix)
+
+    def check(self, event):
+        # An event the checks cannot even evaluate, e.g. a payload that is no JSON or a non-numeric value for
+        # greater_than, fails this rule only instead of raising out of the pass over all rules.
+        if not self.fields and not self.has_items:
+            return []
+        try:
+            failures = self._check(event.event_json)
+        except Exception as e:
+            failures = [f"could not be checked: {e!r}"]
+        return [f"{self.select} {self.target}: {failure}" for failure in failures]
+
+    def _check(self, event_json):
+        failures = []
+        for section, checks in self.fields.items():
+            values = event_json.get(section)
+            if not isinstance(values, dict):
+                # A missing section fails every check on it, lacks included.
+                failures.append(f"{section} is missing")
+                continue
+            for key in checks.get('has', ()):
+                if key not in values:
+                    failures.append(f"{section}.{key} is missing")
+            for key in checks.get('lacks', ()):
+                if key in values:
+                    failures.append(f"{section}.{key} is present")
+            for key, expected in checks.get('equals', {}).items():
+                actual = values.get(key, MISSING)
+                if actual is MISSING or actual != expected:
+                    failures.append(f"{section}.{key} is {'missing' if actual is MISSING else repr(actual)}, "
+                                    f"expected {expected!r}")
+            for key, minimum in checks.get('greater_than', {}).items():
+                actual = values.get(key, MISSING)
+                if actual is MISSING or float(actual) <= minimum:
+                    failures.append(f"{section}.{key} is {'missing' if actual is MISSING else repr(actual)}, "
+                                    f"expected more than {minimum!r}")
+        if self.has_items and not event_json.get('items'):
+            failures.append("items is empty")
+        return failures
+
+
+class RuleObserver:
+    # State of one rule during a pass: how many events it selected and the one event it has to check.
+    def __init__(self, rule):
+        self.rule = rule
+        self.count = 0
+        self.selected = None
+        self.all_failures = []
+        self._selected_failures = None
+        self._tail = deque(maxlen=-rule.index) if isinstance(rule.index, int) and rule.index < 0 else None
+
+    def observe(self, event):
+        self.count += 1
+        if self.rule.select == 'all':
+            self.all_failures.extend(self.rule.check(event))
+        elif self._tail is not None:
+            self._tail.append(event)
+        elif self.count - 1 == self.rule.index:
+            self.selected = event
+
+    def definite_failures(self):
+        # Failures that later events can no longer fix: those of a rule checking all events, or of the first or a
+        # non-negative index once that event was seen. Counts and last events are only known at the end.
+        if self.rule.select == 'all':
+            return self.all_failures
+        if self._tail is not None or self.selected is None:
+            return []
+        if self._selected_failures is None:
+            self._selected_failures = self.rule.check(self.selected)
+        return self._selected_failures
+
+    def failures(self):
+        rule = self.rule
+        if self.count < rule.min_count:
+            return [f"expected at least {rule.min_count} {rule.target} events, found {self.count}"]
+        if rule.select == 'all':
+            return self.all_failures
+        if self._tail is not None and len(self._tail) == self._tail.maxlen:
+            self.selected = self._tail[0]
+        if self.selected is None:
+            return [] if self.count == 0 else [f"no {rule.target} event at index {rule.index} of {self.count}"]
+        return rule.check(self.selected)
+
+
+class ExpectationMatcher:
+    # The rules compiled into one matcher. Every event name is resolved once to the rules that select it, and
+    # match() feeds each event only to those rules, so all rules are evaluated in a single pass over the events.
+    # Only the events a rule ends up checking get their JSON decoded.
+    def __init__(self, rules):
+        self.rules = list(rules)
+        names = [rule.name for rule in self.rules]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ExpectationError(f"duplicate rule names {duplicates}")
+        self._exact = {}
+        self._prefixed = []
+        for position, rule in enumerate(self.rules):
+            if rule.event is not None:
+                self._exact.setdefault(rule.event, []).append(position)
+            else:
+                self._prefixed.append((rule.prefix, position))
+
+    def positions_for(self, event_name):
+        positions = list(self._exact.get(event_name, ()))
+        positions.extend(position for prefix, position in self._prefixed if event_name.startswith(prefix))
+        return sorted(positions)
+
+    def match(self, events):
+        # Returns {rule name: [failure, ...]}; an empty list means the rule passed.
+        session = self.start()
+        for event in events:
+            session.feed(event)
+        return session.results()
+
+    def start(self):
+        return MatchSession(self)
+
+
+class MatchSession:
+    # One evaluation of the matcher's rules that is fed event by event, e.g. while the log is still growing.
+    def __init__(self, matcher):
+        self._matcher = matcher
+        self._observers = [RuleObserver(rule) for rule in matcher.rules]
+        self._dispatch = {}
+
+    def feed(self, event):
+        targets = self._dispatch.get(event.event_name)
+        if targets is None:
+            targets = self._dispatch[event.event_name] = [
+                self._observers[position] for position in self._matcher.positions_for(event.event_name)]
+        for observer in targets:
+            observer.observe(event)
+
+    def results(self):
+        return {observer.rule.name: observer.failures() for observer in self._observers}
+
+    def definite_failures(self):
+        failures = {}
+        for observer in self._observers:
+            rule_failures = observer.definite_failures()
+            if rule_failures:
+                failures[observer.rule.name] = rule_failures
+        return failures
+
+
+def load_expectations(path):
+    with open(path, 'r') as file:
+        specs = yaml.safe_load(file) or []
+    return [ExpectationRule.from_dict(spec) for spec in specs]
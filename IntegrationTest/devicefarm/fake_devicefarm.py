@@ -0,0 +1,284 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import datetime
+import io
+import itertools
+import json
+import random
+import threading
+import time
+import zipfile
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from botocore.exceptions import ClientError
+
+from log_generator import AppiumLogGenerator
+
+DEVICEFARM_LOG_DIR = "Host_Machine_Files/$DEVICEFARM_LOG_DIR"
+POLLING_OPERATIONS = {'GetUpload', 'GetRun', 'ListJobs'}
+JUNIT_REPORT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest" errors="0" failures="0" skipped="0" tests="2">
+<testcase classname="tests.shopping_test.TestShopping" name="test_shopping[test suite 1]"/>
+<testcase classname="tests.shopping_test.TestShopping" name="test_shopping[test suite 2]"/>
+</testsuite></testsuites>
+"""
+
+
+class ArtifactServer:
+    # Local HTTP server standing in for the presigned S3 URLs of Device Farm. It accepts upload PUTs, serves
+    # the registered artifacts and counts the bytes moved in each direction.
+    def __init__(self, chunk_size=1024 * 1024):
+        self.chunk_size = chunk_size
+        self.artifacts = {}
+        self.received = {}
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-devicefarm-http', daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_artifact(self, name, content):
+        self.artifacts[name] = content
+        return f"{self.base_url}/artifacts/{name}"
+
+    def upload_url(self, upload_id):
+        return f"{self.base_url}/uploads/{upload_id}"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_PUT(self):
+                upload_id = self.path.rsplit('/', 1)[-1]
+                remaining = int(self.headers.get('Content-Length', 0))
+                while remaining > 0:
+                    remaining -= len(self.rfile.read(min(remaining, server.chunk_size)))
+                size = int(self.headers.get('Content-Length', 0))
+                with server._lock:
+                    server.received[upload_id] = time.monotonic()
+                    server.bytes_uploaded += size
+                self.send_response(200)
+                self.end_headers()
+
+            def do_GET(self):
+                content = server.artifacts.get(self.path.rsplit('/', 1)[-1])
+                if content is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/zip')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                view = memoryview(content)
+                for offset in range(0, len(content), server.chunk_size):
+                    self.wfile.write(view[offset:offset + server.chunk_size])
+                with server._lock:
+                    server.bytes_downloaded += len(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class FakeDeviceFarm:
+    # Offline stand-in for boto3.client('devicefarm') that implements the calls automate_device_farm.py makes.
+    # Every call sleeps for api_latency seconds and is counted in calls; uploads finish processing
+    # upload_processing_time seconds after their PUT arrives, and each device job runs for job_duration seconds
+    # plus a random share of job_duration_spread. A throttle_rate share of the polling calls (GetUpload, GetRun and
+    # ListJobs) fails with ThrottlingException, as if botocore's own retries had run out.
+    def __init__(self, device_count=3, api_latency=0.0, upload_processing_time=0.0, job_duration=1.0,
+                 job_duration_spread=0.0, artifact_padding=0, appium_log=None, throttle_rate=0.0, seed=None):
+        self.device_count = device_count
+        self.api_latency = api_latency
+        self.upload_processing_time = upload_processing_time
+        self.job_duration = job_duration
+        self.job_duration_spread = job_duration_spread
+        self.throttle_rate = throttle_rate
+        self.calls = Counter()
+        self.server = ArtifactServer().start()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._uploads = {}
+        self._runs = {}
+        self._pools = {}
+        self._artifact_url = self.server.add_artifact(
+            'customer_artifacts.zip', build_customer_artifacts(appium_log or default_appium_log(), artifact_padding))
+
+    def close(self):
+        self.server.stop()
+
+    def api_call_count(self):
+        return sum(self.calls.values())
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+            throttled = operation in POLLING_OPERATIONS and self._random.random() < self.throttle_rate
+        if self.api_latency:
+            time.sleep(self.api_latency)
+        if throttled:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, operation)
+
+    def _arn(self, kind):
+        return f"arn:aws:devicefarm:us-west-2:000000000000:{kind}:fake/{next(self._ids)}"
+
+    def create_upload(self, projectArn, name, type, contentType=None):
+        self._call('CreateUpload')
+        upload_arn = self._arn('upload')
+        upload_id = upload_arn.rsplit('/', 1)[-1]
+        self._uploads[upload_arn] = {'arn': upload_arn, 'id': upload_id, 'name': name, 'type': type}
+        return {'upload': {'arn': upload_arn, 'name': name, 'type': type, 'status': 'INITIALIZED',
+                           'url': self.server.upload_url(upload_id)}}
+
+    def get_upload(self, arn):
+        self._call('GetUpload')
+        upload = self._uploads.get(arn)
+        if upload is None:
+            raise ClientError({'Error': {'Code': 'NotFoundException', 'Message': arn}}, 'GetUpload')
+        received = self.server.received.get(upload['id'])
+        if received is None:
+            status = 'INITIALIZED'
+        elif time.monotonic() - received < self.upload_processing_time:
+            status = 'PROCESSING'
+        else:
+            status = 'SUCCEEDED'
+        return {'upload': {'arn': arn, 'name': upload['name'], 'type': upload['type'], 'status': status}}
+
+    def list_device_pool_compatibility(self, devicePoolArn, appArn=None, testType=None):
+        self._call('ListDevicePoolCompatibility')
+        return {'compatibleDevices': [{'device': device, 'compatible': True}
+                                      for device in self._pool_devices(devicePoolArn)]}
+
+    def create_device_pool(self, projectArn, name, rules, description=None, maxDevices=None):
+        self._call('CreateDevicePool')
+        pool_arn = self._arn('devicepool')
+        device_arns = set(json.loads(rules[0]['value']))
+        self._pools[pool_arn] = [device for device in self._pool_devices(None) if device['arn'] in device_arns]
+        return {'devicePool': {'arn': pool_arn, 'name': name}}
+
+    def delete_device_pool(self, arn):
+        self._call('DeleteDevicePool')
+        self._pools.pop(arn, None)
+        return {}
+
+    def schedule_run(self, projectArn, appArn, devicePoolArn, name, test):
+        self._call('ScheduleRun')
+        run_arn = self._arn('run')
+        started = time.monotonic()
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        jobs = []
+        for device in self._pool_devices(devicePoolArn):
+            duration = self.job_duration + self._random.random() * self.job_duration_spread
+            jobs.append({'arn': self._arn('job'), 'name': device['name'], 'device': device,
+                         'finishes': started + duration, 'started': started_at, 'duration': duration})
+        self._runs[run_arn] = {'arn': run_arn, 'name': name, 'jobs': jobs, 'stopped': False}
+        return {'run': {'arn': run_arn, 'name': name, 'status': 'SCHEDULING'}}
+
+    def get_run(self, arn):
+        self._call('GetRun')
+        run = self._runs[arn]
+        statuses = [self._job_status(job, run) for job in run['jobs']]
+        status = 'COMPLETED' if all(status == 'COMPLETED' for status in statuses) else 'RUNNING'
+        return {'run': {'arn': arn, 'name': run['name'], 'status': status}}
+
+    def stop_run(self, arn):
+        self._call('StopRun')
+        self._runs[arn]['stopped'] = True
+        self._runs[arn].setdefault('stopped_at', datetime.datetime.now(datetime.timezone.utc))
+        return {'run': {'arn': arn, 'status': 'STOPPING'}}
+
+    def list_jobs(self, arn):
+        self._call('ListJobs')
+        run = self._runs[arn]
+        return {'jobs': [self._job_summary(job, run) for job in run['jobs']]}
+
+    def _job_summary(self, job, run):
+        status = self._job_status(job, run)
+        summary = {'arn': job['arn'], 'name': job['name'], 'status': status, 'started': job['started'],
+                   'result': 'PASSED' if status == 'COMPLETED' else 'PENDING'}
+        if status == 'COMPLETED':
+            # A stopped run ends its jobs at the stop, like Device Farm does.
+            stopped = job['started'] + datetime.timedelta(seconds=job['duration'])
+            if 'stopped_at' in run:
+                stopped = min(stopped, run['stopped_at'])
+            summary['stopped'] = stopped
+            minutes = (stopped - job['started']).total_seconds() / 60
+            summary['deviceMinutes'] = {'total': minutes, 'metered': minutes, 'unmetered': 0.0}
+        return summary
+
+    def list_suites(self, arn):
+        self._call('ListSuites')
+        return {'suites': [{'arn': arn + '/setup', 'name': 'Setup Suite'},
+                           {'arn': arn + '/tests', 'name': 'Tests Suite'},
+                           {'arn': arn + '/teardown', 'name': 'Teardown Suite'}]}
+
+    def list_tests(self, arn):
+        self._call('ListTests')
+        return {'tests': [{'arn': arn + '/shopping', 'name': 'Tests'}]}
+
+    def list_artifacts(self, type, arn):
+        self._call('ListArtifacts')
+        if type == 'FILE':
+            artifacts = [{'arn': arn + '/customer', 'name': 'Customer Artifacts', 'type': 'CUSTOMER_ARTIFACT',
+                          'extension': 'zip', 'url': self._artifact_url}]
+        elif type == 'LOG':
+            artifacts = [{'arn': arn + '/log', 'name': 'Test spec output', 'type': 'TESTSPEC_OUTPUT',
+                          'extension': 'txt', 'url': self.server.base_url + '/artifacts/missing.txt'}]
+        else:
+            artifacts = []
+        return {'artifacts': artifacts}
+
+    def _pool_devices(self, pool_arn):
+        if pool_arn in self._pools:
+            return self._pools[pool_arn]
+        return [{'arn': f"arn:aws:devicefarm:us-west-2::device:FAKE{index:04d}",
+                 'name': f"Apple iPhone {index + 1}"} for index in range(self.device_count)]
+
+    @staticmethod
+    def _job_status(job, run):
+        if run['stopped'] or time.monotonic() >= job['finishes']:
+            return 'COMPLETED'
+        return 'RUNNING'
+
+
+def build_customer_artifacts(appium_log, padding=0):
+    # The zip layout Device Farm produces for customer artifacts, with padding bytes of incompressible video to
+    # give the archive a realistic size.
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(f"{DEVICEFARM_LOG_DIR}/appium.log", appium_log)
+        archive.writestr(f"{DEVICEFARM_LOG_DIR}/junitreport.xml", JUNIT_REPORT)
+        if padding:
+            archive.writestr("Host_Machine_Files/video.mp4", random.randbytes(padding), zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+
+def default_appium_log():
+    generator = AppiumLogGenerator(seed=0)
+    return generator.session_block() + generator.session_block()
@@ -0,0 +1,111 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+from appium_log import LogFollower
+from event_expectations import ExpectationMatcher, load_expectations
+from instrumentation import instrumentation
+
+# Checks appium logs against expectations.yaml while they are still arriving. Every log keeps its LogFollower and
+# MatchSession between polls, so each update only parses the appended lines and feeds the new events to the rules.
+# Example: python follow_verifier.py appium.log --expectations expectations.yaml --idle-timeout 60
+
+
+class FollowVerifier:
+    # A growing log only reports the failures later lines cannot fix, a finished log reports every failing rule.
+    # The first failure of any log is kept in first_failure, which the Device Farm pipeline polls to stop the runs.
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.failures = {}
+        self.first_failure = None
+        self._logs = {}
+        self._lock = threading.Lock()
+
+    def poll(self, path, final=False):
+        with self._lock, instrumentation.span('log_verification', log=path, final=final):
+            log = self._logs.get(path)
+            if log is None:
+                log = self._logs[path] = [LogFollower(path), self.matcher.start(), 0]
+            follower, session, restarts = log
+            new_events = follower.poll(final=final)
+            if follower.restarts != restarts:
+                # The log was replaced, so the rules start over with everything read from the new file.
+                session = log[1] = self.matcher.start()
+                log[2] = follower.restarts
+                new_events = follower.recorded_events
+            for event in new_events:
+                session.feed(event)
+            if final:
+                failures = {name: rule_failures for name, rule_failures in session.results().items() if rule_failures}
+            else:
+                failures = session.definite_failures()
+            if failures:
+                self.failures[path] = failures
+                if self.first_failure is None:
+                    self.first_failure = format_failures(path, failures)
+            return failures
+
+    def verify_finished_log(self, path):
+        return self.poll(path, final=True)
+
+
+def format_failures(path, failures):
+    return f"{path}: " + "; ".join(f"{name}: {', '.join(rule_failures)}" for name, rule_failures in failures.items())
+
+
+def follow_logs(verifier, paths, interval, idle_timeout):
+    # Polls every log until it has not grown for idle_timeout seconds, then checks it one last time as finished.
+    # Failures are printed once, as soon as they are known.
+    last_growth = {path: time.monotonic() for path in paths}
+    sizes = {path: -1 for path in paths}
+    reported = {path: set() for path in paths}
+    while last_growth:
+        for path in list(last_growth):
+            size = os.path.getsize(path) if os.path.exists(path) else -1
+            if size != sizes[path]:
+                sizes[path] = size
+                last_growth[path] = time.monotonic()
+            final = time.monotonic() - last_growth[path] >= idle_timeout
+            for name, rule_failures in verifier.poll(path, final=final).items():
+                if name not in reported[path]:
+                    reported[path].add(name)
+                    print(f"FAILED {path} {name}: {', '.join(rule_failures)}")
+            if final:
+                print(f"Finished following {path}")
+                del last_growth[path]
+        if last_growth:
+            time.sleep(interval)
+    return verifier.failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify appium logs against the expectations while they grow.")
+    parser.add_argument('paths', nargs='+', help="appium.log files to follow")
+    parser.add_argument('--expectations', default='expectations.yaml', help="expectation rules to check")
+    parser.add_argument('--interval', type=float, default=2.0, help="seconds between two polls of the logs")
+    parser.add_argument('--idle-timeout', type=float, default=60.0,
+                        help="seconds without growth after which a log counts as finished")
+    args = parser.parse_args()
+
+    verifier = FollowVerifier(ExpectationMatcher(load_expectations(args.expectations)))
+    failures = follow_logs(verifier, args.paths, args.interval, args.idle_timeout)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
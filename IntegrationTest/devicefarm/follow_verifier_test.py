@@ -0,0 +1,116 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import os
+
+import pytest
+
+from appium_log import LogFollower, scan_log
+from event_expectations import ExpectationMatcher, ExpectationRule
+from follow_verifier import FollowVerifier
+from log_generator import AppiumLogGenerator
+
+# Follows generated logs while they are written in odd pieces and checks that the follower ends up with exactly
+# what a full scan of the finished log finds, and that the verifier reports a failing rule before the log is done.
+
+
+def generated_log(seed, sessions):
+    generator = AppiumLogGenerator(seed=seed)
+    return ''.join(generator.session_block() for _ in range(sessions)).encode('utf-8')
+
+
+def scan_summary(log_scan):
+    return {
+        'events': [(event.event_name, event.event_json) for event in log_scan.recorded_events],
+        'submitted_events': list(log_scan.submitted_events),
+        'event_offsets': list(log_scan.event_offsets),
+        'batch_offsets': list(log_scan.batch_offsets),
+        'payload_offsets': list(log_scan.payload_offsets),
+        'batch_send_times': list(log_scan.batch_send_times),
+        'restart_events': [event.event_json for event in log_scan.restart_events],
+        'restart_offsets': list(log_scan.restart_offsets),
+    }
+
+
+def write_in_pieces(path, content, piece_size, on_piece):
+    with open(path, 'wb') as file:
+        for start in range(0, len(content), piece_size):
+            file.write(content[start:start + piece_size])
+            file.flush()
+            on_piece()
+
+
+class TestLogFollower:
+
+    @pytest.mark.parametrize("chunk_size,piece_size", [(1, 997), (7, 4093), (4093, 7919), (1024 * 1024, 65521)])
+    def test_follow_matches_full_scan(self, tmp_path, chunk_size, piece_size):
+        path = str(tmp_path / 'appium.log')
+        content = generated_log(seed=1, sessions=2)
+        # No newline at the end, so the last line only counts once the writer is known to be done.
+        content = content.rstrip(b'\n')
+        follower = LogFollower(path, chunk_size=chunk_size)
+        followed_events = []
+        write_in_pieces(path, content, piece_size, lambda: followed_events.extend(follower.poll()))
+        followed_events.extend(follower.poll(final=True))
+
+        expected = scan_summary(scan_log(path))
+        assert scan_summary(follower.log_scan()) == expected
+        assert [(event.event_name, event.event_json) for event in followed_events] == expected['events']
+        assert follower.restarts == 0
+
+    def test_follow_restarts_on_replaced_log(self, tmp_path):
+        path = str(tmp_path / 'appium.log')
+        with open(path, 'wb') as file:
+            file.write(generated_log(seed=2, sessions=3))
+        follower = LogFollower(path, chunk_size=4093)
+        follower.poll()
+        # A shorter log in place of the first one is a new log and is read again from the start.
+        with open(path, 'wb') as file:
+            file.write(generated_log(seed=3, sessions=1))
+        follower.poll(final=True)
+
+        assert follower.restarts == 1
+        assert scan_summary(follower.log_scan()) == scan_summary(scan_log(path))
+
+
+class TestFollowVerifier:
+
+    def test_index_rule_fails_before_log_is_finished(self, tmp_path):
+        path = str(tmp_path / 'appium.log')
+        content = generated_log(seed=4, sessions=3)
+        matcher = ExpectationMatcher([
+            # The second screen view of a session never is an entrance, so this rule fails as soon as it is seen.
+            ExpectationRule('second_screen_view', event='_screen_view', select=1,
+                            attributes={'equals': {'_entrances': 1}}),
+            # The last event is only known at the end, so this rule must not fail early.
+            ExpectationRule('last_screen_view', event='_screen_view', select='last',
+                            attributes={'equals': {'_entrances': 1}}),
+            ExpectationRule('app_end', event='_app_end', select='last'),
+        ])
+        verifier = FollowVerifier(matcher)
+        early_failures = []
+
+        def poll():
+            failures = verifier.poll(path)
+            if failures and not early_failures:
+                early_failures.append((os.path.getsize(path), failures))
+
+        write_in_pieces(path, content, 8191, poll)
+
+        assert early_failures, "the failing index rule was not reported while the log was growing"
+        written, failures = early_failures[0]
+        assert written < len(content)
+        assert list(failures) == ['second_screen_view']
+        assert verifier.first_failure.startswith(f"{path}: second_screen_view: ")
+
+        final_failures = verifier.verify_finished_log(path)
+        assert sorted(final_failures) == ['last_screen_view', 'second_screen_view']
@@ -0,0 +1,179 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Timed spans and counters of the integration test pipeline, written as JSON next to the JUnit reports in report/
+# so CI can follow them from run to run. automate_device_farm.py writes PIPELINE_REPORT and logcat_test.py
+# LOGCAT_REPORT; the conftest also adds the totals of both to the JUnit report as testsuite properties.
+REPORT_DIR = 'report'
+PIPELINE_REPORT = os.path.join(REPORT_DIR, 'pipeline_metrics.json')
+LOGCAT_REPORT = os.path.join(REPORT_DIR, 'logcat_metrics.json')
+
+
+class Instrumentation:
+    # Spans and counters may be recorded from any thread. A span is one timed phase, e.g. the download of one
+    # artifact, with the attributes it was recorded with; phases() sums the spans of each name.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+            self.counters = Counter()
+            self.results = {}
+            self.started_at = time.time()
+            self._clock_start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.perf_counter() - started, started=started, **attributes)
+
+    def record_span(self, name, seconds, started=None, **attributes):
+        if started is None:
+            started = time.perf_counter() - seconds
+        span = {'name': name, 'start_seconds': round(started - self._clock_start, 4), 'seconds': round(seconds, 4)}
+        span.update(attributes)
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def add_result(self, name, result):
+        # Any JSON result worth tracking next to the timings, e.g. the event reconciliation of one device.
+        with self._lock:
+            self.results[name] = result
+
+    def report(self):
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(sorted(self.counters.items()))
+            results = dict(self.results)
+        return {
+            'started_at': self.started_at,
+            'elapsed_seconds': round(time.perf_counter() - self._clock_start, 4),
+            'phases': phases(spans),
+            'counters': counters,
+            'results': results,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'spans': spans,
+        }
+
+    def write_report(self, path):
+        write_report(self.report(), path)
+
+
+class InstrumentedClient:
+    # Wraps a Device Farm client so every API call is counted per operation, whichever implementation is behind it.
+    def __init__(self, client, instrumentation):
+        self.client = client
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            self._instrumentation.count('api_calls')
+            self._instrumentation.count(f"api_calls.{name}")
+            started = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self._instrumentation.count('api_seconds', time.perf_counter() - started)
+
+        return call
+
+
+def phases(spans):
+    summary = {}
+    for span in spans:
+        phase = summary.setdefault(span['name'], {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        phase['count'] += 1
+        phase['total_seconds'] += span['seconds']
+        phase['max_seconds'] = max(phase['max_seconds'], span['seconds'])
+    for phase in summary.values():
+        phase['total_seconds'] = round(phase['total_seconds'], 4)
+    return summary
+
+
+def merge_reports(reports):
+    # Combines the reports of several processes, e.g. the pytest-xdist workers, into one.
+    spans = []
+    counters = Counter()
+    results = {}
+    for worker, report in reports.items():
+        spans.extend(dict(span, worker=worker) for span in report['spans'])
+        counters.update(report['counters'])
+        results.update(report['results'])
+    return {
+        'started_at': min(report['started_at'] for report in reports.values()),
+        'elapsed_seconds': max(report['elapsed_seconds'] for report in reports.values()),
+        'phases': phases(spans),
+        'counters': dict(sorted(counters.items())),
+        'results': dict(sorted(results.items())),
+        'peak_rss_bytes': max(report['peak_rss_bytes'] for report in reports.values()),
+        'spans': spans,
+    }
+
+
+def report_properties(report, prefix):
+    # The totals of a report as flat (name, value) pairs for JUnit testsuite properties.
+    properties = [(f"{prefix}.elapsed_seconds", report['elapsed_seconds']),
+                  (f"{prefix}.peak_rss_bytes", report['peak_rss_bytes'])]
+    for name, phase in report['phases'].items():
+        properties.append((f"{prefix}.{name}.total_seconds", phase['total_seconds']))
+        properties.append((f"{prefix}.{name}.count", phase['count']))
+    for name, value in report['counters'].items():
+        properties.append((f"{prefix}.{name}", round(value, 4) if isinstance(value, float) else value))
+    properties.extend(numeric_properties(report.get('results', {}), prefix))
+    return properties
+
+
+def numeric_properties(values, prefix):
+    properties = []
+    for name, value in values.items():
+        if isinstance(value, dict):
+            properties.extend(numeric_properties(value, f"{prefix}.{name}"))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            properties.append((f"{prefix}.{name}", value))
+    return properties
+
+
+def write_report(report, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,243 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import argparse
+import json
+import random
+import re
+import uuid
+
+# Writes synthetic appium.log files shaped like the ones the shopping app produces on Device Farm: appium noise
+# around the app_event_log blocks, "Saved event <name>:<json>" lines with the JSON of ClickstreamEvent.toJsonObject
+# and "Send N events at <milliseconds>" lines whenever the SDK would have flushed a batch.
+# Example: python log_generator.py appium.log --size 500MB --noise 4 --seed 1
+
+NOISE_LINES = [
+    '[HTTP] --> POST /wd/hub/session/{session}/element',
+    '[HTTP] {{"using":"id","value":"{element}"}}',
+    '[W3C ({short})] Calling AppiumDriver.findElement() with args: ["id","{element}","{session}"]',
+    '[XCUITest] Executing command \'findElement\'',
+    '[WD Proxy] Matched \'/element\' to command name \'findElement\'',
+    '[WD Proxy] Proxying [POST /element] to [POST http://127.0.0.1:8100/session/{session}/element] with body: '
+    '{{"using":"accessibility id","value":"{element}"}}',
+    '[WD Proxy] Got response with status 200: {{"value":{{"ELEMENT":"{element_id}"}},"sessionId":"{session}"}}',
+    '[W3C ({short})] Responding to client with driver.findElement() result: {{"element-6066-11e4-a52e-4f735466cecf"'
+    ':"{element_id}","ELEMENT":"{element_id}"}}',
+    '[HTTP] <-- POST /wd/hub/session/{session}/element 200 {millis} ms - 137',
+    '[HTTP] --> POST /wd/hub/session/{session}/element/{element_id}/click',
+    '[XCUITest] Executing command \'click\'',
+    '[HTTP] <-- POST /wd/hub/session/{session}/element/{element_id}/click 200 {millis} ms - 14',
+]
+ELEMENTS = ['Profile', 'sign_in', 'Cart', 'check_out', 'purchase', 'sign_out', 'show_log_text', 'event_log']
+SIZE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMG]?)B?$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+class AppiumLogGenerator:
+    # Produces app sessions of the shopping flow, each written as one app_event_log block. Every session ends
+    # with the app going to background and coming back, so the log holds the _app_start after _app_end that the
+    # verifier has to skip.
+    def __init__(self, seed=None, noise=4.0, batch_size=10, products=4):
+        self.random = random.Random(seed)
+        self.noise = noise
+        self.batch_size = batch_size
+        self.products = products
+        self.unique_id = str(uuid.UUID(int=self.random.getrandbits(128)))
+        self.device_id = str(uuid.UUID(int=self.random.getrandbits(128)))
+        self.timestamp = 1700000000000
+        self.session_number = 0
+        self.session_id = ''
+        self.session_start = 0
+        self.previous_screen = None
+        self.first_screen_of_session = True
+        self.events_written = 0
+        self.batches_written = 0
+        self.first_open = True
+
+    def write(self, file, target_size=None, sessions=None):
+        # Writes whole sessions until the log reaches target_size bytes or the requested number of sessions.
+        written = 0
+        session = 0
+        while (target_size is None or written < target_size) and (sessions is None or session < sessions):
+            written += file.write(self.session_block())
+            session += 1
+        return written
+
+    def session_block(self):
+        self.session_number += 1
+        self.session_id = f"{self.unique_id[:8]}-{self.session_number:08d}"
+        self.session_start = self.timestamp
+        self.first_screen_of_session = True
+        lines = []
+        pending = 0
+        for index, (event_name, event_json) in enumerate(self.session_events()):
+            lines.extend(self.noise_lines())
+            prefix = f"{self.log_time()} [HTTP] Logging event app_event_log:" if index == 0 else ""
+            lines.append(f"{prefix}Saved event {event_name}:{event_json}")
+            self.events_written += 1
+            pending += 1
+            if pending >= self.batch_size:
+                lines.append(f"Send {pending} events at {self.send_time()}")
+                self.batches_written += 1
+                pending = 0
+        if pending:
+            lines.append(f"Send {pending} events at {self.send_time()}")
+            self.batches_written += 1
+        lines.extend(self.noise_lines())
+        return "\n".join(lines) + "\n"
+
+    def session_events(self):
+        if self.first_open:
+            self.first_open = False
+            yield self.event('_first_open')
+        yield self.event('_app_start', {'_is_first_time': self.session_number == 1})
+        yield self.event('_session_start')
+        yield self.screen_view('HomeView')
+        yield self.event('view_home')
+        products = [{'id': str(index), 'name': f"product {index}", 'price': round(self.random.uniform(5, 500), 2),
+                     'category': self.random.choice(['men', 'women', 'jewelery', 'electronics'])}
+                    for index in range(self.products)]
+        for product in products:
+            yield self.event('product_exposure', {'id': int(product['id'])}, items=[product])
+        yield self.event('add_to_cart', {'product_id': int(products[0]['id'])}, items=[products[0]])
+        yield self.screen_view('ProfileView')
+        yield self.event('view_profile')
+        yield self.event('_profile_set', user={'_user_id': f"user-{self.session_number}", '_user_name': 'carl'})
+        yield self.event('login')
+        yield self.screen_view('CartView')
+        yield self.event('view_cart')
+        total_price = sum(product['price'] for product in products[:2])
+        yield self.event('check_out_click', {'totalPrice': f"{total_price:.2f}"})
+        yield self.screen_view('ProfileView')
+        yield self.event('_profile_set', user={})
+        yield self.event('logout')
+        yield self.event('_user_engagement', {'_engagement_time_msec': self.random.randint(1500, 60000)})
+        yield self.event('_app_end')
+        # The app comes back from background before the event log is shown.
+        yield self.event('_app_start', {'_is_first_time': False})
+        yield self.screen_view('ProfileView')
+
+    def screen_view(self, screen_name):
+        attributes = {'_screen_name': screen_name, '_screen_id': screen_name,
+                      '_screen_unique_id': str(self.random.getrandbits(40)),
+                      '_entrances': 1 if self.first_screen_of_session else 0}
+        if self.previous_screen is not None:
+            attributes.update({'_previous_screen_name': self.previous_screen[0],
+                               '_previous_screen_id': self.previous_screen[0],
+                               '_previous_screen_unique_id': self.previous_screen[1],
+                               '_previous_timestamp': self.previous_screen[2]})
+        self.previous_screen = (screen_name, attributes['_screen_unique_id'], self.timestamp)
+        self.first_screen_of_session = False
+        return self.event('_screen_view', attributes)
+
+    def event(self, event_name, attributes=None, user=None, items=None):
+        self.timestamp += self.random.randint(5, 3000)
+        event = {
+            'unique_id': self.unique_id,
+            'event_type': event_name,
+            'event_id': str(uuid.UUID(int=self.random.getrandbits(128))),
+            'app_id': 'shopping',
+            'timestamp': self.timestamp,
+            'device_id': self.device_id,
+            'device_unique_id': '',
+            'platform': 'iOS',
+            'os_version': '17.2',
+            'make': 'apple',
+            'brand': 'apple',
+            'model': 'iPhone15,2',
+            'locale': 'en_US',
+            'carrier': 'UNKNOWN',
+            'network_type': 'WIFI',
+            'screen_height': 2556,
+            'screen_width': 1179,
+            'zone_offset': 0,
+            'system_language': 'en',
+            'country_code': 'US',
+            'sdk_version': '0.12.4',
+            'sdk_name': 'aws-solution-clickstream-sdk',
+            'app_version': '1.0',
+            'app_package_name': 'software.aws.solution.ModerneShopping',
+            'app_title': 'ModerneShopping',
+        }
+        if items:
+            event['items'] = items
+        if user is not None:
+            user = {'_user_first_touch_timestamp': 1700000000000, **user}
+            event['user'] = {key: {'value': value, 'set_timestamp': self.timestamp} for key, value in user.items()}
+        event['attributes'] = {
+            '_session_id': self.session_id,
+            '_session_start_timestamp': self.session_start,
+            '_session_duration': self.timestamp - self.session_start,
+            '_session_number': self.session_number,
+            **(attributes or {}),
+        }
+        # Sorted like toJsonString() in the SDK, which serialises with JSONSerialization's .sortedKeys.
+        return event_name, json.dumps(event, separators=(',', ':'), sort_keys=True)
+
+    def send_time(self):
+        # The upload of a batch finishes a little after its last event was saved.
+        return self.timestamp + self.random.randint(50, 1500)
+
+    def noise_lines(self):
+        count = int(self.noise) + (1 if self.random.random() < self.noise - int(self.noise) else 0)
+        session = '5a1b2c3d-0000-4000-8000-00000000a11e'
+        lines = []
+        for _ in range(count):
+            template = self.random.choice(NOISE_LINES)
+            lines.append(f"{self.log_time()} " + template.format(
+                session=session, short=session[:8], element=self.random.choice(ELEMENTS),
+                element_id=f"{self.random.getrandbits(32):08X}-0000-0000-0000-000000000000",
+                millis=self.random.randint(3, 2500)))
+        return lines
+
+    def log_time(self):
+        milliseconds = self.timestamp % (24 * 60 * 60 * 1000)
+        hours, milliseconds = divmod(milliseconds, 60 * 60 * 1000)
+        minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+        seconds, milliseconds = divmod(milliseconds, 1000)
+        return f"2024-01-01 {hours:02d}:{minutes:02d}:{seconds:02d}:{milliseconds:03d}"
+
+
+def generate_appium_log(path, target_size=None, sessions=None, noise=4.0, batch_size=10, seed=None):
+    if target_size is None and sessions is None:
+        sessions = 2
+    generator = AppiumLogGenerator(seed=seed, noise=noise, batch_size=batch_size)
+    with open(path, 'w', encoding='utf-8', buffering=1024 * 1024) as file:
+        size = generator.write(file, target_size=target_size, sessions=sessions)
+    return {'path': path, 'bytes': size, 'sessions': generator.session_number, 'events': generator.events_written,
+            'batches': generator.batches_written}
+
+
+def parse_size(text):
+    match = SIZE_PATTERN.match(text.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic appium.log of the shopping app.")
+    parser.add_argument('path', help="where to write the log")
+    parser.add_argument('--size', type=parse_size, help="approximate size of the log, e.g. 200MB or 2GB")
+    parser.add_argument('--sessions', type=int, help="number of app sessions to write")
+    parser.add_argument('--noise', type=float, default=4.0, help="appium noise lines per event")
+    parser.add_argument('--batch-size', type=int, default=10, help="events per 'Send N events' batch")
+    parser.add_argument('--seed', type=int, help="seed for reproducible logs")
+    args = parser.parse_args()
+    result = generate_appium_log(args.path, target_size=args.size, sessions=args.sessions, noise=args.noise,
+                                 batch_size=args.batch_size, seed=args.seed)
+    print(f"Wrote {result['bytes']} bytes, {result['sessions']} sessions, {result['events']} events and "
+          f"{result['batches']} batches to {result['path']}")
+
+
+if __name__ == '__main__':
+    main()
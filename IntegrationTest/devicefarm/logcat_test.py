@@ -10,28 +10,63 @@ or in the 'license' file accompanying this file. This file is distributed on an
 OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
 and limitations under the License.
 """
-import json
-import re
+import functools
+import os
 
 import pytest
 import yaml
 
+from appium_log import get_cached_recorded_events, get_cached_submitted_events
+from event_expectations import ExpectationMatcher, load_expectations
+from instrumentation import instrumentation
+from reconciliation import format_reconciliation, reconcile_log
+
+expectation_rules = load_expectations("expectations.yaml")
+expectation_matcher = ExpectationMatcher(expectation_rules)
+
+
+def device_log_params(paths):
+    # Every test of one device log is put in the same xdist group, so under "-n auto --dist loadgroup" each
+    # log is parsed by exactly one worker and the parsed-log cache stays local to that worker. xdist appends
+    # "@<group>" to every test id, so the group is the short device_log_id rather than the full log path.
+    return [pytest.param(path, marks=pytest.mark.xdist_group(device_log_id(path))) for path in paths]
+
+
+def device_log_id(path):
+    # Device Farm logs are saved as <run>/<device>/Host_Machine_Files/$DEVICEFARM_LOG_DIR/appium.log and get
+    # <run>/<device>, so two shards or pools that ran the same device model stay apart. Any other log gets
+    # <directory>/<file>, so appium.log files in different directories stay apart as well.
+    head, separator, _ = path.partition('/Host_Machine_Files/')
+    if not separator:
+        head = path
+    return f"{os.path.basename(os.path.dirname(head))}/{os.path.basename(head)}"
+
+
+@functools.lru_cache(maxsize=None)
+def expectation_failures(path):
+    # All rules of expectations.yaml are checked in one pass per device log, the per-rule tests only read the result.
+    return expectation_matcher.match(get_cached_recorded_events(path))
+
 
 class TestLogcatIOS:
-    path = yaml.safe_load(open("ios_path.yaml", "r"))
+    path = device_log_params(yaml.safe_load(open("ios_path.yaml", "r")))
 
     def init_events(self, path):
-        self.recorded_events = get_recorded_events(path)
+        self.recorded_events = get_cached_recorded_events(path)
 
     @pytest.mark.parametrize("path", path)
     def test_upload(self, path):
         print("Start verify: " + str(path))
         self.init_events(path)
-        self.submitted_events = get_submitted_events(path)
+        self.submitted_events = get_cached_submitted_events(path)
         # assert all record events are submitted.
         assert sum(self.submitted_events) > 0
         assert len(self.recorded_events) > 0
         assert sum(self.submitted_events) >= len(self.recorded_events)
+        reconciliation = reconcile_log(path)
+        print(format_reconciliation(reconciliation))
+        # Reported as testsuite properties through the metrics report, the JUnit xunit2 format has no test properties.
+        instrumentation.add_result(f"reconciliation.{device_log_id(path)}", reconciliation)
         print("Verifying successful upload of all events.")
 
     @pytest.mark.parametrize("path", path)
@@ -39,17 +74,14 @@ class TestLogcatIOS:
         print("Start verify: " + str(path))
         self.init_events(path)
         # assert launch events
-        start_events = [self.recorded_events[0]['event_name'],
-                        self.recorded_events[1]['event_name'],
-                        self.recorded_events[2]['event_name'],
-                        self.recorded_events[3]['event_name']]
+        start_events = [self.recorded_events[0].event_name,
+                        self.recorded_events[1].event_name,
+                        self.recorded_events[2].event_name,
+                        self.recorded_events[3].event_name]
         assert '_app_start' in start_events
         assert '_session_start' in start_events
         if '_first_open' not in start_events:
-            first_open_event = next(
-                (event for event in self.recorded_events if '_first_open' in event.get('event_name', '')),
-                None)
-            assert first_open_event is not None
+            assert self.recorded_events.count('_first_open') > 0
         print("Verifying successful order of launch events.")
 
     @pytest.mark.parametrize("path", path)
@@ -57,178 +89,23 @@ class TestLogcatIOS:
         print("Start verify: " + str(path))
         self.init_events(path)
         # assert first _screen_view
-        screen_view_events = [event for event in self.recorded_events if '_screen_view' in event.get('event_name', '')]
-        sorted_screen_view_events = sorted(
-            screen_view_events,
-            key=lambda event: event['event_json'].get('timestamp', float('inf'))
-        )
+        sorted_screen_view_events = self.recorded_events.sorted_by_timestamp('_screen_view')
         screen_view_event = sorted_screen_view_events[0]
-        if screen_view_event['event_json'].get('attributes')['_entrances'] == 0:
+        if screen_view_event.event_json.get('attributes')['_entrances'] == 0:
             screen_view_event = sorted_screen_view_events[1]
-        assert screen_view_event['event_json'].get('attributes')['_entrances'] == 1
-        assert '_screen_name' in screen_view_event['event_json'].get('attributes')
-        assert '_screen_unique_id' in screen_view_event['event_json'].get('attributes')
+        assert screen_view_event.event_json.get('attributes')['_entrances'] == 1
+        assert '_screen_name' in screen_view_event.event_json.get('attributes')
+        assert '_screen_unique_id' in screen_view_event.event_json.get('attributes')
 
-        assert '_session_start_timestamp' in screen_view_event['event_json'].get('attributes')
-        assert '_session_duration' in screen_view_event['event_json'].get('attributes')
-        assert '_session_number' in screen_view_event['event_json'].get('attributes')
+        assert '_session_start_timestamp' in screen_view_event.event_json.get('attributes')
+        assert '_session_duration' in screen_view_event.event_json.get('attributes')
+        assert '_session_number' in screen_view_event.event_json.get('attributes')
         print("Verifying successful attributes of all first _screen_view events.")
 
+    @pytest.mark.parametrize("rule", expectation_rules, ids=lambda rule: rule.name)
     @pytest.mark.parametrize("path", path)
-    def test_last_screen_view(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert last _screen_view
-        screen_view_event = next(
-            (event for event in reversed(self.recorded_events) if '_screen_view' in event.get('event_name', '')),
-            None)
-        assert screen_view_event['event_json'].get('attributes')['_entrances'] == 0
-        assert '_screen_name' in screen_view_event['event_json'].get('attributes')
-        assert '_screen_unique_id' in screen_view_event['event_json'].get('attributes')
-
-        assert '_previous_screen_name' in screen_view_event['event_json'].get('attributes')
-        assert '_previous_screen_unique_id' in screen_view_event['event_json'].get('attributes')
-        assert '_previous_timestamp' in screen_view_event['event_json'].get('attributes')
-
-        print("Verifying successful attributes of all last _screen_view events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_profile_set(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert _profile_set
-        profile_set_event = [event for event in self.recorded_events if '_profile_set' in event.get('event_name', '')]
-        assert '_user_id' not in profile_set_event[-1]['event_json']['user']
-        assert '_user_id' in profile_set_event[-2]['event_json']['user']
-        print("Verifying successful attributes of _profile_set events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_login(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert login
-        login_event = [event for event in self.recorded_events if 'login' in event.get('event_name', '')]
-        assert len(login_event) > 0
-        print("Verifying successful login events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_product_exposure(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert product_exposure
-        product_exposure = next(
-            (event for event in self.recorded_events if 'product_exposure' in event.get('event_name', '')),
-            None)
-        assert len(product_exposure['event_json'].get('items')) > 0
-        assert 'id' in product_exposure['event_json'].get('attributes')
-        print("Verifying successful attributes of product_exposure events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_add_to_cart(self, path):
+    def test_expectation(self, path, rule):
         print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert add_to_cart
-        add_to_cart_event = [event for event in self.recorded_events if 'add_to_cart' in event.get('event_name', '')]
-        assert len(add_to_cart_event) > 0
-        assert 'product_id' in add_to_cart_event[0]['event_json'].get('attributes')
-        print("Verifying successful attributes of add_to_cart_event events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_view_home(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert view_home
-        view_home_event = [event for event in self.recorded_events if 'view_home' in event.get('event_name', '')]
-        assert len(view_home_event) > 0
-        print("Verifying successful view_home events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_view_cart(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert view_cart
-        view_cart_event = [event for event in self.recorded_events if 'view_cart' in event.get('event_name', '')]
-        assert len(view_cart_event) > 0
-        print("Verifying successful view_cart events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_view_profile(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert view_account
-        view_account_event = [event for event in self.recorded_events if 'view_profile' in event.get('event_name', '')]
-        assert len(view_account_event) > 0
-        print("Verifying successful view_account events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_check_out(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert check_out
-        check_out_event = [event for event in self.recorded_events if 'check_out_click' in event.get('event_name', '')]
-        assert len(check_out_event) > 0
-        assert float(check_out_event[0]['event_json'].get('attributes')["totalPrice"]) > 0
-        print("Verifying successful check_out events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_user_engagement(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert _user_engagement
-        user_engagement_event = next(
-            (event for event in self.recorded_events if '_user_engagement' in event.get('event_name', '')),
-            None)
-        assert '_engagement_time_msec' in user_engagement_event['event_json'].get('attributes')
-        assert user_engagement_event['event_json'].get('attributes')['_engagement_time_msec'] > 1000
-        print("Verifying successful attributes of _user_engagement events.")
-
-    @pytest.mark.parametrize("path", path)
-    def test_app_end(self, path):
-        print("Start verify: " + str(path))
-        self.init_events(path)
-        # assert _app_end
-        app_end_event = next((event for event in self.recorded_events if '_app_end' in event.get('event_name', '')),
-                             None)
-        assert app_end_event is not None
-        print("Verifying successful completion of _app_end event.")
-
-
-def get_submitted_events(path):
-    submitted_events = []
-    with open(path, 'r') as file:
-        pattern = re.compile(r'^Send (\d+) events')
-        for line in file:
-            match = pattern.search(line)
-            if match:
-                submitted_events.append(int(match.group(1)))
-    return submitted_events
-
-
-def get_recorded_events(path):
-    with open(path, 'r') as file:
-        log_lines = file.readlines()
-    events = []
-    first_event_pattern = re.compile(r'app_event_log:Saved event (\w+):(.*)$')
-    event_pattern = re.compile(r'^Saved event (\w+):(.*)$')
-
-    current_event_name = ''
-
-    for line in log_lines:
-        first_event_match = first_event_pattern.search(line)
-        event_match = event_pattern.search(line)
-        if first_event_match:
-            event_match = first_event_match
-        if event_match:
-            event_name, event_json = event_match.groups()
-            if event_name == '_app_start' and (
-                    current_event_name == '_app_end' or current_event_name == '_user_engagement'):
-                continue
-            else:
-                events.append({
-                    'event_name': event_name,
-                    'event_json': json.loads(event_json)
-                })
-                current_event_name = event_name
-        else:
-            continue
-    return events
+        failures = expectation_failures(path)[rule.name]
+        assert not failures, "; ".join(failures)
+        print(f"Verifying successful {rule.name} events.")
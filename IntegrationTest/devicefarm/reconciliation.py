@@ -0,0 +1,148 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import argparse
+import heapq
+import itertools
+import json
+import math
+from collections import Counter, deque
+
+import yaml
+
+from appium_log import get_cached_log_scan
+
+# Matches the events saved in an appium.log against the "Send N events" lines. EventRecorder uploads the oldest
+# rows of its SQLite queue first, so every batch is the next N saved events that were not sent yet. The queue
+# outlives the app process, which is why pending events are carried across the app_event_log blocks of a log.
+# The "Send" lines only carry a count, so an event that is sent twice cannot be told apart from two sends of
+# different events; duplicate_saved_events only counts event ids saved more than once. Events saved after the last
+# "Send" line, e.g. the _screen_view after coming back from background, are still queued when the log is dumped and
+# count as unsent_at_end; lost_events are only those that were queued before a later upload and never sent.
+# Example: python reconciliation.py ios_path.yaml --json report/reconciliation.json
+
+PERCENTILES = (50, 90, 99)
+
+
+def reconcile_log(path):
+    # Works on the cached scan of the log, so a log that logcat_test.py already parsed, or that has a sidecar,
+    # is not read again.
+    return dict(path=path, **reconcile_log_scan(get_cached_log_scan(path)))
+
+
+def reconcile_log_scan(log_scan):
+    pending = deque()
+    seen_ids = set()
+    saved_events = duplicate_saved_events = unmatched_sent_events = 0
+    saved_before_last_send = 0
+    batch_sizes = Counter()
+    latencies = []
+    # Batches sort before events on the same offset, as the parser reports them.
+    entries = heapq.merge(
+        zip(log_scan.batch_offsets, itertools.repeat(0), log_scan.submitted_events, log_scan.batch_send_times),
+        zip(log_scan.event_offsets, itertools.repeat(1), log_scan.recorded_events),
+        zip(log_scan.restart_offsets, itertools.repeat(1), log_scan.restart_events))
+    for entry in entries:
+        if entry[1] == 1:
+            event = entry[2]
+            saved_events += 1
+            event_id = event.payload_event_id()
+            if event_id is not None:
+                if event_id in seen_ids:
+                    duplicate_saved_events += 1
+                seen_ids.add(event_id)
+            # Every saved line is its own row of the queue and gets sent, duplicate or not.
+            pending.append(event.payload_timestamp())
+            continue
+        _, _, batch_size, sent_at = entry
+        batch_sizes[batch_size] += 1
+        saved_before_last_send = saved_events
+        for _ in range(batch_size):
+            if not pending:
+                # Events saved before this log started, e.g. by an earlier run on the same device.
+                unmatched_sent_events += 1
+                continue
+            timestamp = pending.popleft()
+            # Both are -1 when the log does not carry them.
+            if sent_at >= 0 and timestamp >= 0:
+                latencies.append(sent_at - timestamp)
+    sent_events = sum(size * count for size, count in batch_sizes.items())
+    # The queue is sent oldest first, so the pending events are the newest ones saved.
+    unsent_at_end = min(len(pending), saved_events - saved_before_last_send)
+    return {
+        'saved_events': saved_events,
+        'unique_events': saved_events - duplicate_saved_events,
+        'sent_events': sent_events,
+        'lost_events': len(pending) - unsent_at_end,
+        'unsent_at_end': unsent_at_end,
+        'duplicate_saved_events': duplicate_saved_events,
+        'unmatched_sent_events': unmatched_sent_events,
+        'batches': sum(batch_sizes.values()),
+        'batch_sizes': {size: batch_sizes[size] for size in sorted(batch_sizes)},
+        'send_latency_ms': latency_summary(latencies),
+    }
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return None
+    latencies.sort()
+    summary = {f"p{percentile}": nearest_rank(latencies, percentile) for percentile in PERCENTILES}
+    summary['max'] = latencies[-1]
+    summary['count'] = len(latencies)
+    return summary
+
+
+def nearest_rank(sorted_values, percentile):
+    rank = max(math.ceil(percentile / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def format_reconciliation(result):
+    lines = [f"{result['path']}: saved {result['saved_events']} ({result['unique_events']} unique), "
+             f"sent {result['sent_events']} in {result['batches']} batches, lost {result['lost_events']}, "
+             f"unsent at the end {result['unsent_at_end']}, "
+             f"saved twice {result['duplicate_saved_events']}, "
+             f"sent without a saved event {result['unmatched_sent_events']}",
+             "  batch sizes: " + ", ".join(f"{size}x{count}" for size, count in result['batch_sizes'].items())]
+    latency = result['send_latency_ms']
+    if latency is None:
+        lines.append("  save-to-send latency: not available, the log has no send times")
+    else:
+        lines.append("  save-to-send latency: " + ", ".join(
+            f"{name} {value}ms" for name, value in latency.items() if name != 'count'))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile saved and sent events of device appium logs.")
+    parser.add_argument('paths', nargs='+', help="appium.log files, or a YAML list of them such as ios_path.yaml")
+    parser.add_argument('--json', dest='json_path', help="write the per-device results to this JSON file")
+    args = parser.parse_args()
+
+    log_paths = []
+    for path in args.paths:
+        if path.endswith(('.yaml', '.yml')):
+            with open(path, 'r') as file:
+                log_paths.extend(yaml.safe_load(file))
+        else:
+            log_paths.append(path)
+    results = [reconcile_log(path) for path in log_paths]
+    for result in results:
+        print(format_reconciliation(result))
+    if args.json_path:
+        with open(args.json_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance
+with the License. A copy of the License is located at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES
+OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions
+and limitations under the License.
+"""
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'LimitExceededException',
+}
+
+
+class WaitTimeoutError(Exception):
+    pass
+
+
+class Waiter:
+    # Calls poll() until it returns something other than None. The delay between polls starts small so short
+    # waits finish quickly, grows exponentially with jitter up to max_delay, and the whole wait is bounded by
+    # timeout seconds. Throttling errors from the API only lengthen the backoff instead of failing the wait.
+    def __init__(self, initial_delay=1.0, max_delay=30.0, multiplier=2.0, timeout=None,
+                 sleep=time.sleep, clock=time.monotonic):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.timeout = timeout
+        self.sleep = sleep
+        self.clock = clock
+        self.polls = 0
+        self.throttles = 0
+
+    def delays(self):
+        delay = self.initial_delay
+        while True:
+            # Equal jitter: never less than half the backoff, so pollers started together drift apart.
+            yield random.uniform(delay / 2, delay)
+            delay = min(delay * self.multiplier, self.max_delay)
+
+    def wait_until(self, poll, description="condition"):
+        deadline = None if self.timeout is None else self.clock() + self.timeout
+        delays = self.delays()
+        while True:
+            self.polls += 1
+            try:
+                result = poll()
+            except ClientError as e:
+                if not is_throttling_error(e):
+                    raise
+                self.throttles += 1
+                print(f"Throttled while waiting for {description}: {e.response['Error']['Code']}")
+                # Skip one step of the backoff so throttled pollers slow down faster than idle ones.
+                next(delays)
+                result = None
+            if result is not None:
+                return result
+            delay = next(delays)
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    raise WaitTimeoutError(f"Timed out after {self.timeout}s waiting for {description}")
+                delay = min(delay, remaining)
+            self.sleep(delay)
+
+
+def is_throttling_error(error):
+    return error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES